@@ -0,0 +1,408 @@
+#  This file is part of pybootchartgui.
+
+#  pybootchartgui is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  pybootchartgui is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with pybootchartgui. If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk cache of compiled traces.
+
+A cache entry holds everything a Trace knows after compile().  The
+bulky per-sample data is laid out as typed columns, and the entry is
+mapped into memory on load.  With NumPy, the cpu and disk statistics
+are read-only arrays over the mapping, which stays mapped for as long
+as they are used; the samples of the processes, which can still be
+cropped or appended to, are copied out of it, as are the columns
+without NumPy.  The small remainder (headers, process descriptions,
+the kernel init calls) is kept as a JSON preamble.
+
+    magic | preamble length | JSON preamble, padded | columns ...
+
+Entries are keyed by FORMAT_VERSION and by the size and modification
+time of every input file.  Logs which were set aside to be parsed on
+demand are recorded as such, and the entry is also keyed by which logs
+those were, and by the time window loaded.
+
+Next to the traces, the cache keeps an index of the timestamp and byte
+offset of every block of the timed-block logs, so that loading another
+window of a trace goes straight to the blocks inside it:
+
+    magic | block count | timestamps | offsets, ending with the log size
+"""
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .samples import CPUStats, DiskStats, MemSample, Process, ProcessSamples, \
+     ProcessStats, column_list, to_column
+
+# bumped whenever what is kept in an entry, or how, changes
+FORMAT_VERSION = 4
+MAGIC = b'PYBC'
+SUFFIX = '.bct'
+INDEX_SUFFIX = '.bci'
+ALIGN = 8
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pybootchartgui')
+
+def _stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return '%s:missing' % path
+    return '%s:%d:%d' % (path, st.st_size, int(st.st_mtime * 1000000))
+
+def cache_key(paths, needed_logs=(), window=None):
+    """Returns the cache key for parsing the given paths, loading the
+    optional logs in needed_logs up front and only the samples in window."""
+    h = hashlib.sha1()
+    h.update(('%s:%d' % (MAGIC.decode('ascii'), FORMAT_VERSION)).encode('utf-8'))
+    h.update(','.join(sorted(needed_logs)).encode('utf-8'))
+    h.update(repr(window).encode('utf-8'))
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+            signatures = [_stat_signature(f) for f in files if os.path.isfile(f)]
+        else:
+            signatures = [_stat_signature(path)]
+        for signature in signatures:
+            h.update(signature.encode('utf-8', 'replace'))
+    return h.hexdigest()
+
+def index_key(origin):
+    """Returns the cache key for the block index of the log at origin,
+    either ('path', filename) or ('tar', archive, member)."""
+    h = hashlib.sha1()
+    h.update(('%s:%d:index' % (MAGIC.decode('ascii'), FORMAT_VERSION)).encode('utf-8'))
+    h.update(_stat_signature(origin[1]).encode('utf-8', 'replace'))
+    for name in origin[2:]:
+        h.update(('/' + name).encode('utf-8', 'replace'))
+    return h.hexdigest()
+
+class _ColumnWriter:
+    def __init__(self):
+        self.columns = []
+
+    def add(self, name, typecode, values):
+        self.columns.append((name, array.array(typecode, column_list(values))))
+
+    def layout(self, base):
+        """Returns {name: (typecode, offset, count)} for data starting at base."""
+        index = {}
+        offset = base
+        for name, column in self.columns:
+            offset += -offset % ALIGN
+            index[name] = (column.typecode, offset, len(column))
+            offset += len(column) * column.itemsize
+        return index
+
+    def write(self, f, base):
+        offset = base
+        for name, column in self.columns:
+            pad = -offset % ALIGN
+            f.write(b'\0' * pad)
+            data = column.tobytes()
+            f.write(data)
+            offset += pad + len(data)
+
+class TraceCache:
+    """A directory of cached traces, trimmed to max_size bytes by evicting
+    the least recently used entries."""
+
+    def __init__(self, writer, directory=None, max_size=256 * 1024 * 1024):
+        self.writer = writer
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+
+    def _entry(self, trace, paths):
+        key = cache_key(paths, trace._needed_logs, trace._window)
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, trace, paths):
+        """Fills in the compiled state of trace from the cache, returning
+        False if there is no usable entry for paths."""
+        entry = self._entry(trace, paths)
+        if not os.path.exists(entry):
+            return False
+        try:
+            with open(entry, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # not closed: the statistics may be views of it, and it is
+            # unmapped once they are gone
+            _restore(self.writer, trace, mm)
+        except (IOError, OSError, ValueError, KeyError, TypeError, struct.error) as error:
+            self.writer.warn("warning: ignoring unreadable cache entry '%s': %s" % (entry, error))
+            return False
+        # mark as recently used
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        self.writer.status("loaded cached trace '%s'" % entry)
+        return True
+
+    def store(self, trace, paths):
+        if self.max_size <= 0:
+            return
+        self._write(self._entry(trace, paths), lambda f: _save(trace, f))
+
+    def load_index(self, origin):
+        """Returns the (timestamps, offsets) index of the timed blocks of
+        the log at origin, or None if it is not in the cache."""
+        entry = os.path.join(self.directory, index_key(origin) + INDEX_SUFFIX)
+        if not os.path.exists(entry):
+            return None
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError("bad magic")
+            count = struct.unpack('<Q', data[len(MAGIC):len(MAGIC) + 8])[0]
+            times, offsets = array.array('q'), array.array('q')
+            start = len(MAGIC) + 8
+            middle = start + count * times.itemsize
+            times.frombytes(data[start:middle])
+            offsets.frombytes(data[middle:])
+            if len(times) != count or len(offsets) != count + 1:
+                raise ValueError("truncated index")
+        except (IOError, OSError, ValueError, struct.error) as error:
+            self.writer.warn("warning: ignoring unreadable cache entry '%s': %s" % (entry, error))
+            return None
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return times, offsets
+
+    def store_index(self, origin, times, offsets):
+        if self.max_size <= 0:
+            return
+        def save(f):
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(times)))
+            f.write(times.tobytes())
+            f.write(offsets.tobytes())
+        self._write(os.path.join(self.directory, index_key(origin) + INDEX_SUFFIX), save)
+
+    def _write(self, entry, save):
+        tmp = '%s.%d.tmp' % (entry, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp, 'wb') as f:
+                save(f)
+            os.rename(tmp, entry)
+        except (IOError, OSError) as error:
+            self.writer.warn("warning: could not write cache entry '%s': %s" % (entry, error))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict(keep=entry)
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache fits."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith((SUFFIX, INDEX_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort(reverse=True)
+        total = 0
+        for mtime, size, path in entries:
+            total += size
+            if total > self.max_size and path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+def _loaded(trace, name):
+    """Returns the part of trace called name, without parsing it if it
+    was set aside."""
+    return trace.__dict__.get(name)
+
+def _save(trace, f):
+    columns = _ColumnWriter()
+
+    cpu_stats = _loaded(trace, 'cpu_stats')
+    if cpu_stats is not None:
+        for name in CPUStats.fields:
+            columns.add('cpu.' + name, 'q' if name == 'time' else 'd', getattr(cpu_stats, name))
+    disk_stats = _loaded(trace, 'disk_stats')
+    if disk_stats is not None:
+        for name in DiskStats.fields:
+            columns.add('disk.' + name, 'q' if name == 'time' else 'd', getattr(disk_stats, name))
+
+    mem_stats = _loaded(trace, 'mem_stats')
+    if mem_stats is not None:
+        columns.add('mem.time', 'q', [s.time for s in mem_stats])
+        for key in MemSample.used_values:
+            columns.add('mem.' + key, 'q', [s.records[key] for s in mem_stats])
+
+    if trace.parent_map is not None:
+        columns.add('parent.pid', 'q', list(trace.parent_map.keys()))
+        columns.add('parent.ppid', 'q', list(trace.parent_map.values()))
+
+    ps_stats = trace.ps_stats
+    processes = []
+    samples = ProcessSamples()
+    for key, proc in ps_stats.process_map.items():
+        processes.append([key, proc.pid, proc.cmd, proc.exe, proc.args, proc.ppid,
+                          proc.start_time, proc.duration, proc.active, len(proc.samples)])
+        samples.extend(proc.samples)
+    for name, typecode in zip(ProcessSamples.columns, ProcessSamples.typecodes):
+        columns.add('proc.' + name, typecode, getattr(samples, name))
+
+    kernel = None
+    if trace.kernel is not None:
+        kernel = [[p.pid, p.cmd, p.ppid, p.start_time, p.duration] for p in trace.kernel]
+    cmdline = None
+    if _loaded(trace, 'cmdline') is not None:
+        cmdline = [[pid, values['exe'], values['args']] for pid, values in trace.cmdline.items()]
+
+    meta = {
+        'filename': trace.filename,
+        'headers': dict(trace.headers),
+        'taskstats': trace.taskstats,
+        'has_cpu_stats': cpu_stats is not None,
+        'has_disk_stats': disk_stats is not None,
+        'has_mem_stats': mem_stats is not None,
+        'has_parent_map': trace.parent_map is not None,
+        'cmdline': cmdline,
+        'kernel': kernel,
+        'ps': [ps_stats.sample_count, ps_stats.sample_period,
+               ps_stats.start_time, ps_stats.end_time],
+        'processes': processes,
+        'pending_logs': trace._pending_logs,
+    }
+    # column offsets are relative to the aligned end of the preamble
+    meta['columns'] = dict((name, list(value)) for name, value in columns.layout(0).items())
+    preamble = json.dumps(meta).encode('utf-8')
+    preamble += b' ' * (-(len(MAGIC) + 8 + len(preamble)) % ALIGN)
+
+    f.write(MAGIC)
+    f.write(struct.pack('<Q', len(preamble)))
+    f.write(preamble)
+    columns.write(f, 0)
+
+def _restore(writer, trace, mm):
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError("bad magic")
+    prefix = len(MAGIC) + 8
+    width = struct.unpack('<Q', mm[len(MAGIC):prefix])[0]
+    meta = json.loads(mm[prefix:prefix + width].decode('utf-8'))
+    base = prefix + width
+
+    view = memoryview(mm)
+    def column(name):
+        typecode, offset, count = meta['columns'][name]
+        size = array.array(typecode).itemsize
+        cview = view[base + offset:base + offset + count * size].cast(typecode)
+        try:
+            return cview.tolist()
+        finally:
+            cview.release()
+
+    def stats_column(name):
+        if numpy is None:
+            return to_column(column(name), name.endswith('.time'))
+        typecode, offset, count = meta['columns'][name]
+        if base + offset + count * array.array(typecode).itemsize > len(mm):
+            raise ValueError("truncated column '%s'" % name)
+        return numpy.frombuffer(mm, dtype=numpy.dtype(typecode), count=count, offset=base + offset)
+
+    def fill_samples(samples, idx, count):
+        for name in ProcessSamples.columns:
+            typecode, offset, total = meta['columns']['proc.' + name]
+            if idx + count > total:
+                raise ValueError("truncated column 'proc.%s'" % name)
+            size = array.array(typecode).itemsize
+            start = base + offset + idx * size
+            getattr(samples, name).frombytes(view[start:start + count * size])
+
+    try:
+        trace.filename = meta['filename']
+        trace.headers = defaultdict(str, meta['headers'])
+        trace.taskstats = meta['taskstats']
+
+        trace._pending_logs = dict((name, tuple(source))
+                                   for name, source in meta['pending_logs'].items())
+
+        if meta['has_cpu_stats']:
+            trace.cpu_stats = CPUStats(*[stats_column('cpu.' + name) for name in CPUStats.fields])
+        if meta['has_disk_stats']:
+            trace.disk_stats = DiskStats(*[stats_column('disk.' + name) for name in DiskStats.fields])
+
+        if meta['has_mem_stats']:
+            trace.mem_stats = []
+            values = [column('mem.' + key) for key in MemSample.used_values]
+            for idx, t in enumerate(column('mem.time')):
+                sample = MemSample(t)
+                for key, value in zip(MemSample.used_values, values):
+                    sample.add_value(key, value[idx])
+                trace.mem_stats.append(sample)
+
+        trace.parent_map = None
+        if meta['has_parent_map']:
+            trace.parent_map = dict(zip(column('parent.pid'), column('parent.ppid')))
+
+        if meta['cmdline'] is not None:
+            trace.cmdline = dict((pid, {'exe': exe, 'args': args})
+                                 for pid, exe, args in meta['cmdline'])
+
+        trace.kernel = None
+        if meta['kernel'] is not None:
+            trace.kernel = []
+            for pid, cmd, ppid, start_time, duration in meta['kernel']:
+                proc = Process(writer, pid, cmd, ppid, start_time)
+                proc.duration = duration
+                trace.kernel.append(proc)
+
+        process_map = {}
+        idx = 0
+        for key, pid, cmd, exe, args, ppid, start_time, duration, active, count in meta['processes']:
+            proc = Process(writer, pid, cmd, ppid, start_time)
+            proc.exe = exe
+            proc.args = args
+            proc.duration = duration
+            proc.active = active
+            fill_samples(proc.samples, idx, count)
+            proc.samples.recount()
+            idx += count
+            process_map[key] = proc
+        for proc in process_map.values():
+            if proc.ppid != None:
+                proc.parent = process_map.get(proc.ppid)
+
+        sample_count, sample_period, start_time, end_time = meta['ps']
+        trace.ps_stats = ProcessStats(writer, process_map, sample_count, sample_period,
+                                      start_time, end_time)
+    finally:
+        view.release()
@@ -19,8 +19,17 @@ import math
 import re
 import random
 import colorsys
+import weakref
+from bisect import bisect_left
 from operator import itemgetter
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from .samples import merge_samples
+
 class RenderOptions:
 
 	def __init__(self, app_options):
@@ -112,6 +121,8 @@ SIGNATURE = "http://github.com/mmeeks/bootchart"
 DEP_COLOR = (0.75, 0.75, 0.75, 1.0)
 # Process dependency line stroke.
 DEP_STROKE = 1.0
+# Process dependency line dashes.
+DEP_DASH = [2, 2]
 
 # Process description date format.
 DESC_TIME_FORMAT = "mm:ss.SSS"
@@ -131,6 +142,10 @@ STATE_ZOMBIE    = 5
 STATE_COLORS = [(0, 0, 0, 0), PROC_COLOR_R, PROC_COLOR_S, PROC_COLOR_D, \
 		PROC_COLOR_T, PROC_COLOR_Z, PROC_COLOR_X, PROC_COLOR_W]
 
+# Levels of alpha of the running color, so that samples of about the
+# same load are drawn as one span.
+ALPHA_STEPS = 32
+
 # CumulativeStats Types
 STAT_TYPE_CPU = 0
 STAT_TYPE_IO = 1
@@ -154,16 +169,56 @@ def draw_rect(ctx, color, rect):
 	ctx.rectangle(*rect)
 	ctx.stroke()
 
-def draw_legend_box(ctx, label, fill_color, x, y, s):
-	draw_fill_rect(ctx, fill_color, (x, y - s, s, s))
-	draw_rect(ctx, PROC_BORDER_COLOR, (x, y - s, s, s))
-	draw_text(ctx, label, TEXT_COLOR, x + s + 5, y)
-
-def draw_legend_line(ctx, label, fill_color, x, y, s):
-	draw_fill_rect(ctx, fill_color, (x, y - s/2, s + 1, 3))
-	ctx.arc(x + (s + 1)/2.0, y - (s - 3)/2.0, 2.5, 0, 2.0 * math.pi)
+class RenderBatch:
+	"""Collects what is drawn in a part of the chart, to fill the
+	rectangles of each color at once.  They are filled layer by layer,
+	by color in the order the colors came within a layer, and under all
+	the rest, which is drawn after them in the order it came: rectangles
+	which must be drawn over others go in a higher layer."""
+
+	def __init__(self):
+		self.colors = []
+		self.rects = {}
+		self.ops = []
+
+	def fill_rect(self, color, rect, layer = 0):
+		key = (layer, color)
+		rects = self.rects.get(key)
+		if rects is None:
+			rects = self.rects[key] = []
+			self.colors.append(key)
+		rects.append(rect)
+
+	def later(self, draw, *args):
+		"""Calls draw with the context and args once the fills are done."""
+		self.ops.append((draw, args))
+
+	def flush(self, ctx):
+		for key in sorted(self.colors, key = itemgetter(0)):
+			ctx.set_source_rgba(*key[1])
+			for rect in self.rects[key]:
+				ctx.rectangle(*rect)
+			ctx.fill()
+		for draw, args in self.ops:
+			draw(ctx, *args)
+		self.colors = []
+		self.rects = {}
+		self.ops = []
+
+def draw_legend_box(batch, label, fill_color, x, y, s):
+	batch.fill_rect(fill_color, (x, y - s, s, s))
+	batch.later(draw_rect, PROC_BORDER_COLOR, (x, y - s, s, s))
+	batch.later(draw_text, label, TEXT_COLOR, x + s + 5, y)
+
+def draw_legend_line(batch, label, fill_color, x, y, s):
+	batch.fill_rect(fill_color, (x, y - s/2, s + 1, 3))
+	batch.later(draw_dot, fill_color, x + (s + 1)/2.0, y - (s - 3)/2.0, 2.5)
+	batch.later(draw_text, label, TEXT_COLOR, x + s + 5, y)
+
+def draw_dot(ctx, color, x, y, r):
+	ctx.set_source_rgba(*color)
+	ctx.arc(x, y, r, 0, 2.0 * math.pi)
 	ctx.fill()
-	draw_text(ctx, label, TEXT_COLOR, x + s + 5, y)
 
 def draw_label_in_box(ctx, color, label, x, y, w, maxx):
 	label_w = ctx.text_extents(label)[2]
@@ -218,22 +273,92 @@ def draw_annotations(ctx, proc_tree, times, rect):
     ctx.set_line_cap(cairo.LINE_CAP_BUTT)
     ctx.set_dash([])
 
-def draw_chart(ctx, color, fill, chart_bounds, data, proc_tree, data_range):
+def _column_max(column):
+	if hasattr(column, 'max'):
+		return column.max()
+	return max(column)
+
+def _transform_column(column, base, scale, offset, extra = 0):
+	"""Maps column values to device coordinates, vectorized when the
+	column is a NumPy array."""
+	if hasattr(column, 'dtype'):
+		return ((column - base) * scale + offset + extra).tolist()
+	return [(value - base) * scale + offset + extra for value in column]
+
+def _take(column, indices):
+	if hasattr(column, 'dtype'):
+		return column[indices]
+	return [column[i] for i in indices]
+
+def _decimate(times, values, x_shift, xscale, x_offset, pixel):
+	"""Returns the indices of the samples to draw a chart with: in each
+	column of pixels, those with the lowest and the highest value, along
+	with the first and the last sample, in time order."""
+	last = len(times) - 1
+	if numpy is not None and hasattr(times, 'dtype'):
+		columns = numpy.floor(((times - x_shift) * xscale + x_offset) * pixel)
+		# by column, then by value, the lowest first and earlier samples first
+		order = numpy.lexsort((numpy.asarray(values), columns))
+		starts = numpy.flatnonzero(numpy.diff(columns[order])) + 1
+		lows = order[numpy.concatenate(([0], starts))]
+		highs = order[numpy.concatenate((starts - 1, [last]))]
+		return numpy.unique(numpy.concatenate(([0, last], lows, highs)))
+	picked = [0]
+	column = low = high = None
+	for idx, time in enumerate(times):
+		col = math.floor(((time - x_shift) * xscale + x_offset) * pixel)
+		if col != column:
+			if column is not None:
+				picked.extend(sorted(set((low, high))))
+			column, low, high = col, idx, idx
+			continue
+		if values[idx] < values[low]:
+			low = idx
+		if values[idx] >= values[high]:
+			high = idx
+	picked.extend(sorted(set((low, high))))
+	picked.append(last)
+	return sorted(set(picked))
+
+# the samples picked by _decimate for the charts of an owner, by name,
+# kept for as long as the owner lives and the place of the chart is the
+# same; old traces are not kept alive by them
+_decimated = weakref.WeakKeyDictionary()
+
+def _decimated_samples(ctx, key, times, values, chart_bounds, x_shift, xscale):
+	"""Returns the samples of a chart worth drawing: about two in each
+	column of pixels it covers on the device."""
+	pixel = abs(ctx.user_to_device_distance(1.0, 0.0)[0])
+	if len(times) <= 2 * chart_bounds[2] * pixel:
+		return times, values
+	place = (len(times), x_shift, xscale, chart_bounds[0], pixel)
+	entry = None
+	if key is not None:
+		charts = _decimated.setdefault(key[0], {})
+		entry = charts.get(key[1])
+	if entry is None or entry[0] != place:
+		indices = _decimate(times, values, x_shift, xscale, chart_bounds[0], pixel)
+		if key is not None:
+			charts[key[1]] = (place, indices)
+	else:
+		indices = entry[1]
+	return _take(times, indices), _take(values, indices)
+
+def draw_chart(ctx, color, fill, chart_bounds, times, values, proc_tree, data_range, key = None):
+	"""Draws values over times.  With more samples than pixels, only the
+	lowest and the highest sample of each column of pixels is drawn;
+	those are remembered by key, the (owner, name) of the series, as long
+	as the owner lives."""
 	ctx.set_line_width(0.5)
 	x_shift = proc_tree.start_time
 
-	def transform_point_coords(point, x_base, y_base, \
-				   xscale, yscale, x_trans, y_trans):
-		x = (point[0] - x_base) * xscale + x_trans
-		y = (point[1] - y_base) * -yscale + y_trans + chart_bounds[3]
-		return x, y
-
-	max_x = max (x for (x, y) in data)
-	max_y = max (y for (x, y) in data)
+	max_x = _column_max (times)
+	max_y = _column_max (values)
 	# avoid divide by zero
 	if max_y == 0:
 		max_y = 1.0
 	xscale = float (chart_bounds[2]) / max_x
+	times, values = _decimated_samples (ctx, key, times, values, chart_bounds, x_shift, xscale)
 	# If data_range is given, scale the chart so that the value range in
 	# data_range matches the chart bounds exactly.
 	# Otherwise, scale so that the actual data matches the chart bounds.
@@ -244,16 +369,14 @@ def draw_chart(ctx, color, fill, chart_bounds, data, proc_tree, data_range):
 		yscale = float(chart_bounds[3]) / max_y
 		ybase = 0
 
-	first = transform_point_coords (data[0], x_shift, ybase, xscale, yscale, \
-				        chart_bounds[0], chart_bounds[1])
-	last =  transform_point_coords (data[-1], x_shift, ybase, xscale, yscale, \
-				        chart_bounds[0], chart_bounds[1])
+	xs = _transform_column (times, x_shift, xscale, chart_bounds[0])
+	ys = _transform_column (values, ybase, -yscale, chart_bounds[1], chart_bounds[3])
+	first = (xs[0], ys[0])
+	last = (xs[-1], ys[-1])
 
 	ctx.set_source_rgba(*color)
 	ctx.move_to(*first)
-	for point in data:
-		x, y = transform_point_coords (point, x_shift, ybase, xscale, yscale, \
-					       chart_bounds[0], chart_bounds[1])
+	for x, y in zip (xs, ys):
 		ctx.line_to(x, y)
 	if fill:
 		ctx.stroke_preserve()
@@ -300,43 +423,52 @@ def render_charts(ctx, options, clip, trace, curr_y, w, h, sec_w):
 	# render bar legend
 	ctx.set_font_size(LEGEND_FONT_SIZE)
 
-	draw_legend_box(ctx, "CPU (user+sys)", CPU_COLOR, off_x, curr_y+20, leg_s)
-	draw_legend_box(ctx, "I/O (wait)", IO_COLOR, off_x + 120, curr_y+20, leg_s)
+	batch = RenderBatch()
+	draw_legend_box(batch, "CPU (user+sys)", CPU_COLOR, off_x, curr_y+20, leg_s)
+	draw_legend_box(batch, "I/O (wait)", IO_COLOR, off_x + 120, curr_y+20, leg_s)
+	batch.flush(ctx)
 
 	# render I/O wait
+	cpu_stats = trace.cpu_stats
 	chart_rect = (off_x, curr_y+30, w, bar_h)
 	if clip_visible (clip, chart_rect):
 		draw_box_ticks (ctx, chart_rect, sec_w)
 		draw_annotations (ctx, proc_tree, trace.times, chart_rect)
 		draw_chart (ctx, IO_COLOR, True, chart_rect, \
-			    [(sample.time, sample.user + sample.sys + sample.io) for sample in trace.cpu_stats], \
-			    proc_tree, None)
+			    cpu_stats.time, cpu_stats.cpu_io, \
+			    proc_tree, None, (cpu_stats, 'cpu_io'))
 		# render CPU load
 		draw_chart (ctx, CPU_COLOR, True, chart_rect, \
-			    [(sample.time, sample.user + sample.sys) for sample in trace.cpu_stats], \
-			    proc_tree, None)
+			    cpu_stats.time, cpu_stats.cpu, \
+			    proc_tree, None, (cpu_stats, 'cpu'))
 
 	curr_y = curr_y + 30 + bar_h
 
 	# render second chart
-	draw_legend_line(ctx, "Disk throughput", DISK_TPUT_COLOR, off_x, curr_y+20, leg_s)
-	draw_legend_box(ctx, "Disk utilization", IO_COLOR, off_x + 120, curr_y+20, leg_s)
+	draw_legend_line(batch, "Disk throughput", DISK_TPUT_COLOR, off_x, curr_y+20, leg_s)
+	draw_legend_box(batch, "Disk utilization", IO_COLOR, off_x + 120, curr_y+20, leg_s)
+	batch.flush(ctx)
 
         # render I/O utilization
+	disk_stats = trace.disk_stats
 	chart_rect = (off_x, curr_y+30, w, bar_h)
 	if clip_visible (clip, chart_rect):
 		draw_box_ticks (ctx, chart_rect, sec_w)
 		draw_annotations (ctx, proc_tree, trace.times, chart_rect)
 		draw_chart (ctx, IO_COLOR, True, chart_rect, \
-			    [(sample.time, sample.util) for sample in trace.disk_stats], \
-			    proc_tree, None)
+			    disk_stats.time, disk_stats.util, \
+			    proc_tree, None, (disk_stats, 'util'))
 
 	# render disk throughput
-	max_sample = max (trace.disk_stats, key = lambda s: s.tput)
+	disk_tput = disk_stats.tput
+	if hasattr(disk_tput, 'argmax'):
+		max_sample = disk_stats[int(disk_tput.argmax())]
+	else:
+		max_sample = disk_stats[max(range(len(disk_tput)), key = disk_tput.__getitem__)]
 	if clip_visible (clip, chart_rect):
 		draw_chart (ctx, DISK_TPUT_COLOR, False, chart_rect, \
-			    [(sample.time, sample.tput) for sample in trace.disk_stats], \
-			    proc_tree, None)
+			    disk_stats.time, disk_tput, \
+			    proc_tree, None, (disk_stats, 'tput'))
 
 	pos_x = off_x + ((max_sample.time - proc_tree.start_time) * w / proc_tree.duration)
 
@@ -354,26 +486,30 @@ def render_charts(ctx, options, clip, trace, curr_y, w, h, sec_w):
 	mem_stats = trace.mem_stats
 	if mem_stats and clip_visible (clip, chart_rect):
 		mem_scale = max(sample.records['MemTotal'] - sample.records['MemFree'] for sample in mem_stats)
-		draw_legend_box(ctx, "Mem cached (scale: %u MiB)" % (float(mem_scale) / 1024), MEM_CACHED_COLOR, off_x, curr_y+20, leg_s)
-		draw_legend_box(ctx, "Used", MEM_USED_COLOR, off_x + 240, curr_y+20, leg_s)
-		draw_legend_box(ctx, "Buffers", MEM_BUFFERS_COLOR, off_x + 360, curr_y+20, leg_s)
-		draw_legend_line(ctx, "Swap (scale: %u MiB)" % max([(sample.records['SwapTotal'] - sample.records['SwapFree'])/1024 for sample in mem_stats]), \
+		draw_legend_box(batch, "Mem cached (scale: %u MiB)" % (float(mem_scale) / 1024), MEM_CACHED_COLOR, off_x, curr_y+20, leg_s)
+		draw_legend_box(batch, "Used", MEM_USED_COLOR, off_x + 240, curr_y+20, leg_s)
+		draw_legend_box(batch, "Buffers", MEM_BUFFERS_COLOR, off_x + 360, curr_y+20, leg_s)
+		draw_legend_line(batch, "Swap (scale: %u MiB)" % max([(sample.records['SwapTotal'] - sample.records['SwapFree'])/1024 for sample in mem_stats]), \
 				 MEM_SWAP_COLOR, off_x + 480, curr_y+20, leg_s)
+		batch.flush(ctx)
 		draw_box_ticks(ctx, chart_rect, sec_w)
 		draw_annotations(ctx, proc_tree, trace.times, chart_rect)
-		draw_chart(ctx, MEM_BUFFERS_COLOR, True, chart_rect, \
-			   [(sample.time, sample.records['MemTotal'] - sample.records['MemFree']) for sample in trace.mem_stats], \
-			   proc_tree, [0, mem_scale])
-		draw_chart(ctx, MEM_USED_COLOR, True, chart_rect, \
-			   [(sample.time, sample.records['MemTotal'] - sample.records['MemFree'] - sample.records['Buffers']) for sample in mem_stats], \
-			   proc_tree, [0, mem_scale])
-		draw_chart(ctx, MEM_CACHED_COLOR, True, chart_rect, \
-			   [(sample.time, sample.records['Cached']) for sample in mem_stats], \
-			   proc_tree, [0, mem_scale])
-		draw_chart(ctx, MEM_SWAP_COLOR, False, chart_rect, \
-			   [(sample.time, float(sample.records['SwapTotal'] - sample.records['SwapFree'])) for sample in mem_stats], \
-			   proc_tree, None)
-
+		mem_times = [sample.time for sample in mem_stats]
+		draw_chart(ctx, MEM_BUFFERS_COLOR, True, chart_rect, mem_times, \
+			   [sample.records['MemTotal'] - sample.records['MemFree'] for sample in mem_stats], \
+			   proc_tree, [0, mem_scale], (trace, 'mem_buffers'))
+		draw_chart(ctx, MEM_USED_COLOR, True, chart_rect, mem_times, \
+			   [sample.records['MemTotal'] - sample.records['MemFree'] - sample.records['Buffers'] for sample in mem_stats], \
+			   proc_tree, [0, mem_scale], (trace, 'mem_used'))
+		draw_chart(ctx, MEM_CACHED_COLOR, True, chart_rect, mem_times, \
+			   [sample.records['Cached'] for sample in mem_stats], \
+			   proc_tree, [0, mem_scale], (trace, 'mem_cached'))
+		draw_chart(ctx, MEM_SWAP_COLOR, False, chart_rect, mem_times, \
+			   [float(sample.records['SwapTotal'] - sample.records['SwapFree']) for sample in mem_stats], \
+			   proc_tree, None, (trace, 'mem_swap'))
+
+	# what follows is in the same place, whether the chart is drawn or not
+	if mem_stats:
 		curr_y = curr_y + meminfo_bar_h
 
 	return curr_y
@@ -437,14 +573,16 @@ def render(ctx, options, xscale, trace):
 def draw_process_bar_chart(ctx, clip, options, proc_tree, times, curr_y, w, h, sec_w):
 	header_size = 0
 	if not options.kernel_only:
-		draw_legend_box (ctx, "Running (%cpu)",
+		batch = RenderBatch()
+		draw_legend_box (batch, "Running (%cpu)",
 				 PROC_COLOR_R, off_x    , curr_y + 45, leg_s)
-		draw_legend_box (ctx, "Unint.sleep (I/O)",
+		draw_legend_box (batch, "Unint.sleep (I/O)",
 				 PROC_COLOR_D, off_x+120, curr_y + 45, leg_s)
-		draw_legend_box (ctx, "Sleeping",
+		draw_legend_box (batch, "Sleeping",
 				 PROC_COLOR_S, off_x+240, curr_y + 45, leg_s)
-		draw_legend_box (ctx, "Zombie",
+		draw_legend_box (batch, "Zombie",
 				 PROC_COLOR_Z, off_x+360, curr_y + 45, leg_s)
+		batch.flush(ctx)
 		header_size = 45
 
 	chart_rect = [off_x, curr_y + header_size + 15,
@@ -459,10 +597,10 @@ def draw_process_bar_chart(ctx, clip, options, proc_tree, times, curr_y, w, h, s
 	draw_sec_labels (ctx, chart_rect, sec_w, nsec)
 	draw_annotations (ctx, proc_tree, times, chart_rect)
 
-	y = curr_y + 60
-	for root in proc_tree.process_tree:
-		draw_processes_recursively(ctx, root, proc_tree, y, proc_h, chart_rect, clip)
-		y = y + proc_h * proc_tree.num_nodes([root])
+	# the rows do not overlap, so their fills are batched together
+	batch = RenderBatch()
+	draw_process_rows(batch, proc_tree, curr_y + 60, proc_h, chart_rect, clip)
+	batch.flush(ctx)
 
 
 def draw_header (ctx, headers, duration):
@@ -497,12 +635,47 @@ def draw_header (ctx, headers, duration):
 
     return header_y
 
-def draw_processes_recursively(ctx, proc, proc_tree, y, proc_h, rect, clip) :
-	x = rect[0] +  ((proc.start_time - proc_tree.start_time) * rect[2] / proc_tree.duration)
+def draw_process_rows(batch, proc_tree, y, proc_h, rect, clip):
+	"""Draws the rows of processes from y on which the clip shows, with
+	the lines from their parents and the lines crossing it to the rows
+	below, the rows above and below it being left out."""
+	order, depths, sizes = proc_tree.layout()
+	first = max(0, int((clip[1] - y) // proc_h) - 1)
+	last = min(len(order) - 1, int((clip[1] + clip[3] - y) // proc_h))
+	# the lines to the processes drawn, each drawn once the subtree of
+	# its process is, so that it ends up over the rows it crosses
+	lines = []
+	for row in range(first, last + 1):
+		while lines and lines[-1][0] < row:
+			batch.later(draw_process_connecting_lines, *lines.pop()[1:])
+		proc = order[row]
+		proc_y = y + proc_h * row
+		x = draw_process(batch, proc, proc_tree, proc_y, proc_h, rect, clip)
+		parent_row = proc_tree.parent_row(row)
+		if parent_row >= 0:
+			lines.append((row + sizes[row] - 1, process_x(order[parent_row], proc_tree, rect),
+				      y + proc_h * parent_row, x, proc_y, proc_h))
+	while lines:
+		batch.later(draw_process_connecting_lines, *lines.pop()[1:])
+	# the lines to children below the clip still cross it; they are cut
+	# short below it by whole dashes, which leaves the dashes in place
+	bottom = y + proc_h * (last + 1)
+	period = sum(DEP_DASH)
+	for parent_row, child_row in proc_tree.lines_past(last):
+		child_y = y + proc_h * child_row
+		child_y -= (child_y - bottom) // period * period
+		batch.later(draw_process_connecting_lines, process_x(order[parent_row], proc_tree, rect),
+			    y + proc_h * parent_row, process_x(order[child_row], proc_tree, rect), child_y, proc_h)
+
+def process_x(proc, proc_tree, rect):
+	return rect[0] +  ((proc.start_time - proc_tree.start_time) * rect[2] / proc_tree.duration)
+
+def draw_process(batch, proc, proc_tree, y, proc_h, rect, clip):
+	x = process_x(proc, proc_tree, rect)
 	w = ((proc.duration) * rect[2] / proc_tree.duration)
 
-	draw_process_activity_colors(ctx, proc, proc_tree, x, y, w, proc_h, rect, clip)
-	draw_rect(ctx, PROC_BORDER_COLOR, (x, y, w, proc_h))
+	draw_process_activity_colors(batch, proc, proc_tree, x, y, w, proc_h, rect, clip)
+	batch.later(draw_rect, PROC_BORDER_COLOR, (x, y, w, proc_h))
 	ipid = int(proc.pid)
 	if not OPTIONS.show_all:
 		cmdString = proc.cmd
@@ -516,58 +689,107 @@ def draw_processes_recursively(ctx, proc, proc_tree, y, proc_h, rect, clip) :
 		else:
 			cmdString = cmdString + " " + proc.exe
 
-	draw_label_in_box(ctx, PROC_TEXT_COLOR, cmdString, x, y + proc_h - 4, w, rect[0] + rect[2])
+	batch.later(draw_label_in_box, PROC_TEXT_COLOR, cmdString, x, y + proc_h - 4, w, rect[0] + rect[2])
 
-	next_y = y + proc_h
-	for child in proc.child_list:
-		if next_y > clip[1] + clip[3]:
-			break
-		child_x, child_y = draw_processes_recursively(ctx, child, proc_tree, next_y, proc_h, rect, clip)
-		draw_process_connecting_lines(ctx, x, y, child_x, child_y, proc_h)
-		next_y = next_y + proc_h * proc_tree.num_nodes([child])
-
-	return x, y
+	return x
 
 
-def draw_process_activity_colors(ctx, proc, proc_tree, x, y, w, proc_h, rect, clip):
+def draw_process_activity_colors(batch, proc, proc_tree, x, y, w, proc_h, rect, clip):
 
 	if y > clip[1] + clip[3] or y + proc_h + 2 < clip[1]:
 		return
 
-	draw_fill_rect(ctx, PROC_COLOR_S, (x, y, w, proc_h))
-
+	batch.fill_rect(PROC_COLOR_S, (x, y, w, proc_h))
+
+	# the [x, width, color, layer] to fill: samples of the same color
+	# next to each other make one span, and of the samples within one
+	# pixel only the one with the highest alpha is drawn; a span over
+	# those before it is drawn in a layer above them
+	spans = []
+	layer = 1
+	max_end = None
+
+	samples = proc.samples
+	times = samples.time
+	start_time = proc_tree.start_time
+	duration = proc_tree.duration
+	rect_x, rect_w = rect[0], rect[2]
+	clip_x, clip_end = clip[0], clip[0] + clip[2]
+	sample_w = round(proc_tree.sample_period * rect_w / float(duration))
+
+	def sample_x(idx):
+		return rect_x + round(((times[idx] - start_time) * rect_w / duration))
+
+	# samples are sorted chronologically: skip to one drawn before the
+	# clip after which they are placed as in a full render, the first
+	# one or one which the sample before it cannot reach into
+	first = min(bisect_left(times, start_time + (clip_x - rect_x - 1) * duration / float(rect_w)), len(times) - 1)
 	last_tx = -1
-	for sample in proc.samples :
-		tx = rect[0] + round(((sample.time - proc_tree.start_time) * rect[2] / proc_tree.duration))
+	while first >= 0:
+		tx = sample_x(first)
+		if tx + max(sample_w, 1) <= clip_x and \
+		   (first == 0 or sample_w == 0 or tx - sample_x(first - 1) >= 2):
+			last_tx = tx + max(sample_w, 1)
+			break
+		first -= 1
 
-		# samples are sorted chronologically
-		if tx < clip[0]:
-			continue
-		if tx > clip[0] + clip[2]:
+	for idx in range(first + 1, len(times)):
+		tx = sample_x(idx)
+
+		# a sample may still be pulled back next to the one before it
+		if tx > clip_end + sample_w:
 			break
 
-		tw = round(proc_tree.sample_period * rect[2] / float(proc_tree.duration))
+		tw = sample_w
 		if last_tx != -1 and abs(last_tx - tx) <= tw:
 			tw -= last_tx - tx
 			tx = last_tx
 		tw = max (tw, 1) # nice to see at least something
 
 		last_tx = tx + tw
-		state = get_proc_state( sample.state )
+		state = get_proc_state( chr(samples.state[idx]) )
 
 		color = STATE_COLORS[state]
 		if state == STATE_RUNNING:
-			alpha = min (sample.cpu_sample.user + sample.cpu_sample.sys, 1.0)
-			color = tuple(list(PROC_COLOR_R[0:3]) + [alpha])
-#			print "render time %d [ tx %d tw %d ], sample state %s color %s alpha %g" % (sample.time, tx, tw, state, color, alpha)
+			alpha = min (samples.user[idx] + samples.sys[idx], 1.0)
+			alpha = round (alpha * ALPHA_STEPS) / float(ALPHA_STEPS)
+			color = PROC_COLOR_R[0:3] + (alpha,)
+#			print "render time %d [ tx %d tw %d ], sample state %s color %s alpha %g" % (times[idx], tx, tw, state, color, alpha)
 		elif state == STATE_SLEEPING:
 			continue
+		if color[3] == 0:
+			continue
 
-		draw_fill_rect(ctx, color, (tx, y, tw, proc_h))
+		if spans:
+			span = spans[-1]
+			end = span[0] + span[1]
+			if tw == 1 and tx == end - 1:
+				# within the last pixel of the span
+				if color != span[2] and color[3] >= span[2][3]:
+					if span[1] > 1:
+						span[1] -= 1
+						spans.append([tx, 1, color, span[3]])
+					elif len(spans) > 1 and spans[-2][0] + spans[-2][1] == tx and spans[-2][2:] == [color, span[3]]:
+						spans.pop()
+						spans[-1][1] += 1
+					else:
+						span[2] = color
+				continue
+			if tx == end and color == span[2]:
+				span[1] += tw
+				max_end = max(max_end, tx + tw)
+				continue
+			if tx < max_end:
+				layer += 1
+		spans.append([tx, tw, color, layer])
+		max_end = tx + tw if max_end is None else max(max_end, tx + tw)
+
+	for tx, tw, color, layer in spans:
+		batch.fill_rect(color, (tx, y, tw, proc_h), layer)
 
 def draw_process_connecting_lines(ctx, px, py, x, y, proc_h):
 	ctx.set_source_rgba(*DEP_COLOR)
-	ctx.set_dash([2, 2])
+	ctx.set_dash(DEP_DASH)
 	if abs(px - x) < 3:
 		dep_off_x = 3
 		dep_off_y = proc_h / 4
@@ -589,13 +811,17 @@ def elide_bootchart(proc):
 class CumlSample:
 	def __init__(self, proc):
 		self.cmd = proc.cmd
-		self.samples = []
+		self.runs = []
 		self.merge_samples (proc)
 		self.color = None
 
 	def merge_samples(self, proc):
-		self.samples.extend (proc.samples)
-		self.samples.sort (key = lambda p: p.time)
+		self.runs.append (proc.samples)
+
+	@property
+	def samples(self):
+		"""The samples of all the processes merged, ordered by time."""
+		return merge_samples (self.runs)
 
 	def next(self):
 		global palette_idx
@@ -619,7 +845,7 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 	global palette_idx
 	palette_idx = 0
 
-	time_hash = {}
+	time_hash = set()
 	total_time = 0.0
 	m_proc_list = {}
 
@@ -631,10 +857,9 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 		if elide_bootchart(proc):
 			continue
 
-		for sample in proc.samples:
-			total_time += getattr(sample.cpu_sample, sample_value)
-			if not sample.time in time_hash:
-				time_hash[sample.time] = 1
+		# totalled as the samples were taken
+		total_time += getattr(proc.samples, sample_value + '_total')
+		time_hash.update(proc.samples.time)
 
 		# merge pids with the same cmd
 		if not proc.cmd in m_proc_list:
@@ -672,10 +897,15 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 		row = {}
 		cuml = 0.0
 
-		# print "pid : %s -> %g samples %d" % (proc.cmd, cuml, len (cs.samples))
-		for sample in cs.samples:
-			cuml += getattr(sample.cpu_sample, sample_value)
-			row[sample.time] = cuml
+		samples = cs.samples
+		if stat_type is STAT_TYPE_CPU:
+			values = [user + sys for user, sys in zip(samples.user, samples.sys)]
+		else:
+			values = samples.io
+		# print "pid : %s -> %g samples %d" % (proc.cmd, cuml, len (samples))
+		for time, value in zip(samples.time, values):
+			cuml += value
+			row[time] = cuml
 
 		process_total_time = cuml
 
@@ -714,7 +944,6 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 				w = math.ceil ((time - last_time) * chart_bounds[2] / proc_tree.duration) + 1
 				x = chart_bounds[0] + round((last_time - proc_tree.start_time) * chart_bounds[2] / proc_tree.duration)
 				ctx.rectangle (x, below[last_time] - last_cuml, w, last_cuml)
-				ctx.fill()
 #				ctx.stroke()
 				last_time = time
 				y = below [time] - cuml
@@ -725,6 +954,7 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 		x = chart_bounds[0] + round((last_time - proc_tree.start_time) * chart_bounds[2] / proc_tree.duration)
 		y = below[last_time] - cuml
 		ctx.rectangle (x, y, chart_bounds[2] - x, cuml)
+		# one fill for all the segments, which have the same color
 		ctx.fill()
 #		ctx.stroke()
 
@@ -776,13 +1006,15 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 	i = 0
 	legends = sorted(legends, key=itemgetter(1), reverse=True)
 	ctx.set_font_size(TEXT_FONT_SIZE)
+	batch = RenderBatch()
 	for t in legends:
 		cs = t[0]
 		time = t[1]
 		x = chart_bounds[0] + off_x + int (i/LEGENDS_PER_COL) * label_width
 		y = chart_bounds[1] + font_height * ((i % LEGENDS_PER_COL) + 2)
 		str = "%s - %.0f(ms) (%2.2f%%)" % (cs.cmd, time/1000000, (time/total_time) * 100.0)
-		draw_legend_box(ctx, str, cs.color, x, y, leg_s)
+		draw_legend_box(batch, str, cs.color, x, y, leg_s)
 		i = i + 1
 		if i >= LEGENDS_TOTAL:
 			break
+	batch.flush(ctx)
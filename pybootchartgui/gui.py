@@ -100,6 +100,10 @@ class PyBootchartWidget(gtk.DrawingArea):
         new_x = old_mid_x
         self.zoom_image (self.zoom_ratio)
 
+    def on_trace_changed(self):
+        self.chart_width, self.chart_height = draw.extents(self.options, self.xscale, self.trace)
+        self.zoom_image (self.zoom_ratio)
+
     def on_expand(self, action):
         self.set_xscale (self.xscale * 1.5)
 
@@ -123,6 +127,10 @@ class PyBootchartWidget(gtk.DrawingArea):
         self.options.app_options.show_all = button.get_property ('active')
         self.queue_draw()
 
+    def prune_toggled(self, button):
+        self.options.proc_tree(self.trace).set_view(button.get_property ('active'))
+        self.on_trace_changed()
+
     POS_INCREMENT = 100
 
     def on_key_press_event(self, widget, event):
@@ -304,6 +312,11 @@ class PyBootchartShell(gtk.VBox):
             button.connect ('toggled', self.widget.show_toggled)
             hbox.pack_start (button, False, True)
 
+            button = gtk.CheckButton("Prune")
+            button.set_active (options.app_options.prune)
+            button.connect ('toggled', self.widget.prune_toggled)
+            hbox.pack_start (button, False, True)
+
         self.pack_start(hbox, False)
         self.pack_start(scrolled)
         self.show_all()
@@ -328,6 +341,7 @@ class PyBootchartWindow(gtk.Window):
         full_opts = RenderOptions(app_options)
         full_tree = PyBootchartShell(window, trace, full_opts, 1.0)
         tab_page.append_page (full_tree, gtk.Label("Full tree"))
+        self.shells = [ full_tree ]
 
         if trace.kernel is not None and len (trace.kernel) > 2:
             kernel_opts = RenderOptions(app_options)
@@ -336,12 +350,23 @@ class PyBootchartWindow(gtk.Window):
             kernel_opts.kernel_only = True
             kernel_tree = PyBootchartShell(window, trace, kernel_opts, 5.0)
             tab_page.append_page (kernel_tree, gtk.Label("Kernel boot"))
+            self.shells.append (kernel_tree)
 
         full_tree.grab_focus(self)
         self.show()
 
 
+# how often a live trace is polled, in ms
+LIVE_POLL_INTERVAL = 1000
+
 def show(trace, options):
     win = PyBootchartWindow(trace, options)
     win.connect('destroy', gtk.main_quit)
+    if getattr(options, 'live', False):
+        def poll():
+            if trace.poll():
+                for shell in win.shells:
+                    shell.widget.on_trace_changed()
+            return True
+        gobject.timeout_add(LIVE_POLL_INTERVAL, poll)
     gtk.main()
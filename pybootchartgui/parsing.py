@@ -16,30 +16,103 @@
 
 from __future__ import with_statement
 
-import codecs
-import itertools
+import io
+import mmap
 import os
 import string
 import re
+import struct
 import sys
 import tarfile
+from array import array
+from bisect import bisect_left, bisect_right
 try:
     from time import perf_counter
 except ImportError:
     from time import clock as perf_counter
 from collections import defaultdict
 from functools import reduce
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 
 from .samples import *
 from .process_tree import ProcessTree
+from .cache import TraceCache
 
 if sys.version_info >= (3, 0):
     long = int
 
 # Parsing produces as its end result a 'Trace'
 
-class Trace:
-    def __init__(self, writer, paths, options):
+# logs which only some outputs use; unless asked for up front they are
+# set aside while loading and parsed when their part is first used
+_LAZY_LOGS = set(['proc_stat.log', 'proc_diskstats.log', 'proc_meminfo.log', 'cmdline2.log'])
+
+def _needed_logs(options):
+    """Returns the lazily parsed logs the output selected by options uses."""
+    if getattr(options, 'interactive', False):
+        # the charts and full command lines can be switched on at will
+        return set(_LAZY_LOGS)
+    needed = set()
+    if not options.boottime:
+        # the charts
+        needed.update(['proc_stat.log', 'proc_diskstats.log', 'proc_meminfo.log'])
+    if options.crop_after:
+        # idle detection, matching on the executable as well
+        needed.update(['proc_stat.log', 'proc_diskstats.log', 'cmdline2.log'])
+    if options.show_all:
+        needed.add('cmdline2.log')
+    return needed
+
+class _LazyLog(object):
+    """A part of a Trace which is parsed from its log on first access,
+    if the log was set aside while loading."""
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+
+    def __get__(self, trace, owner):
+        if trace is None:
+            return self
+        if self.log in trace._pending_logs:
+            trace._load_log(self.log)
+        return trace.__dict__.get(self.name)
+
+    def __set__(self, trace, value):
+        trace.__dict__[self.name] = value
+
+def _log_window(window):
+    """Converts a (start, end) window in seconds, either of which may be
+    None, to the units of the log timestamps."""
+    if window is None or window == (None, None):
+        return None
+    return tuple(None if t is None else int(round(t * 100)) for t in window)
+
+def _window_text(window):
+    """Describes a (start, end) window in 1/100s."""
+    start, end = window
+    return "from %s to %s" % ("the start" if start is None else "%gs" % (start / 100.0),
+                              "the end" if end is None else "%gs" % (end / 100.0))
+
+class Trace(object):
+    cpu_stats = _LazyLog('cpu_stats', 'proc_stat.log')
+    disk_stats = _LazyLog('disk_stats', 'proc_diskstats.log')
+    mem_stats = _LazyLog('mem_stats', 'proc_meminfo.log')
+    cmdline = _LazyLog('cmdline', 'cmdline2.log')
+
+    def __init__(self, writer, paths, options, window=None):
+        """Loads the trace in paths.  If a (start, end) window in seconds
+        is given, or set with the --from and --to options, only the samples
+        taken in that window are loaded.  The trace is cached if options
+        says so, which by default it only does with a cache directory."""
+        self._writer = writer
+        self._needed_logs = _needed_logs(options)
+        self._pending_logs = {}
+        if window is None:
+            window = (getattr(options, 'window_from', None), getattr(options, 'window_to', None))
+        self._window = _log_window(window)
         self.headers = None
         self.disk_stats = None
         self.ps_stats = None
@@ -47,37 +120,44 @@ class Trace:
         self.cpu_stats = None
         self.cmdline = None
         self.kernel = None
-        self.kernel_tree = None
+        self._kernel_tree = None
         self.filename = None
         self.parent_map = None
         self.mem_stats = None
-
-        parse_paths (writer, self, paths)
-        if not self.valid():
-            raise ParseError("empty state: '%s' does not contain a valid bootchart" % ", ".join(paths))
-
-        # Turn that parsed information into something more useful
-        # link processes into a tree of pointers, calculate statistics
-        self.compile(writer)
+        self._proc_index = None
+
+        cache = None
+        cache_dir = getattr(options, 'cache_dir', None)
+        if getattr(options, 'cache', cache_dir is not None):
+            cache = TraceCache(writer, cache_dir, getattr(options, 'cache_size', 256) * 1024 * 1024)
+        # also holds the block indices used for windows
+        self._cache = cache
+
+        if cache is None or not cache.load(self, paths):
+            parse_paths (writer, self, paths, getattr(options, 'jobs', 1))
+            if self._window is not None and \
+               (not self.valid() or not any(proc.samples for proc in self.ps_stats.process_map.values())):
+                raise ParseError("no samples of '%s' were taken %s" % (", ".join(paths), _window_text(self._window)))
+            if not self.valid():
+                raise ParseError("empty state: '%s' does not contain a valid bootchart" % ", ".join(paths))
+
+            # Turn that parsed information into something more useful
+            # link processes into a tree of pointers, calculate statistics
+            self.compile(writer)
+
+            if cache is not None:
+                cache.store(self, paths)
 
         # Crop the chart to the end of the first idle period after the given
         # process
         if options.crop_after:
-            idle = self.crop (writer, options.crop_after)
+            idle = self.crop (writer, options.crop_after,
+                              int(round(getattr(options, 'idle_window', 3.0) * 100)),
+                              getattr(options, 'idle_threshold', 0.25))
         else:
             idle = None
 
-        # Annotate other times as the first start point of given process lists
-        self.times = [ idle ]
-        if options.annotate:
-            for procnames in options.annotate:
-                names = [x[:15] for x in procnames.split(",")]
-                for proc in self.ps_stats.process_map.values():
-                    if proc.cmd in names:
-                        self.times.append(proc.start_time)
-                        break
-                    else:
-                        self.times.append(None)
+        self.times = self._annotate(options.annotate, idle)
 
         self.proc_tree = ProcessTree(writer, self.kernel, self.ps_stats,
                                      self.ps_stats.sample_period,
@@ -85,120 +165,158 @@ class Trace:
                                      options.prune, idle, self.taskstats,
                                      self.parent_map is not None)
 
-        if self.kernel is not None:
-            self.kernel_tree = ProcessTree(writer, self.kernel, None, 0,
-                                           self.headers.get("profile.process"),
-                                           False, None, None, True)
+    def _annotate(self, annotate, idle):
+        # Annotate other times as the first start point of given process lists
+        times = [ idle ]
+        if annotate:
+            for procnames in annotate:
+                names = [x[:15] for x in procnames.split(",")]
+                proc = self.proc_index.first(names)
+                times.append(None if proc is None else proc.start_time)
+        return times
+
+    @property
+    def proc_index(self):
+        """The processes by name, see ProcessIndex."""
+        if self._proc_index is None:
+            self._proc_index = ProcessIndex(self.ps_stats.process_map.values())
+        return self._proc_index
+
+    @property
+    def kernel_tree(self):
+        if self._kernel_tree is None and self.kernel is not None:
+            self._kernel_tree = ProcessTree(self._writer, self.kernel, None, 0,
+                                            self.headers.get("profile.process"),
+                                            False, None, None, True)
+        return self._kernel_tree
+
+    def _load_log(self, name):
+        _parse_pending_log(self._writer, self, name, self._pending_logs.pop(name))
+        if name == 'cmdline2.log' and self.ps_stats is not None:
+            self._merge_cmdline()
 
     def valid(self):
-        return self.headers != None and self.disk_stats != None and \
-               self.ps_stats != None and self.cpu_stats != None
+        def available(name, log):
+            # without parsing a log which was set aside
+            return log in self._pending_logs or self.__dict__.get(name) != None
+        return self.headers != None and available('disk_stats', 'proc_diskstats.log') and \
+               self.ps_stats != None and available('cpu_stats', 'proc_stat.log')
+
+    def _merge_cmdline(self):
+        if self.cmdline is None:
+            return
+        for proc in self.ps_stats.process_map.values():
+            rpid = int (proc.pid // 1000)
+            if rpid in self.cmdline:
+                cmd = self.cmdline[rpid]
+                proc.exe = cmd['exe']
+                proc.args = cmd['args']
+        # the index by executable is stale
+        self._proc_index = None
+#            else:
+#                print "proc %d '%s' not in cmdline" % (rpid, proc.exe)
 
 
     def compile(self, writer):
+        processes = self.ps_stats.process_map.values()
+
+        # merge in the cmdline data, unless it is only parsed when used
+        if 'cmdline2.log' not in self._pending_logs:
+            self._merge_cmdline()
+
+        self._link_processes(processes)
+
+        # count on fingers variously
+        for process in processes:
+            process.calc_stats (self.ps_stats.sample_period)
+
+        if self._window is not None and self._window[0] is not None:
+            # the processes running when the window opens start with it
+            start = self._window[0]
+            for process in processes:
+                if process.start_time < start:
+                    process.duration = max(process.duration - (start - process.start_time), 0)
+                    process.start_time = start
+
+    def _link_processes(self, processes):
+        parent_map = self.parent_map
+        process_map = self.ps_stats.process_map
+        # pid -> pid of its nearest ancestor with an entry in process_map
+        resolved = { 0 : 0 }
 
         def find_parent_id_for(pid):
-            if pid == 0:
-                return 0
-            ppid = self.parent_map.get(pid)
-            if ppid:
-                # many of these double forks are so short lived
-                # that we have no samples, or process info for them
-                # so climb the parent hierarcy to find one
-                if int (ppid * 1000) not in self.ps_stats.process_map:
-#                    print "Pid '%d' short lived with no process" % ppid
-                    ppid = find_parent_id_for (ppid)
-#                else:
-#                    print "Pid '%d' has an entry" % ppid
+            # many of the double forks are so short lived that we have no
+            # samples, or process info for them so climb the parent
+            # hierarchy to find one; everything climbed past resolves to
+            # the same ancestor, so remember it for all of them
+            path = []
+            climbed = set()
+            while pid not in resolved:
+                path.append(pid)
+                climbed.add(pid)
+                ppid = parent_map.get(pid)
+                if not ppid:
+#                    print "Pid '%d' missing from pid map" % pid
+                    ppid = 0
+                    break
+                if int (ppid * 1000) in process_map:
+                    break
+#                print "Pid '%d' short lived with no process" % ppid
+                if ppid in climbed:
+                    # a looping pid map has no answer
+                    ppid = 0
+                    break
+                pid = ppid
             else:
-#                print "Pid '%d' missing from pid map" % pid
-                return 0
+                ppid = resolved[pid]
+            for pid in path:
+                resolved[pid] = ppid
             return ppid
 
-        # merge in the cmdline data
-        if self.cmdline is not None:
-            for proc in self.ps_stats.process_map.values():
-                rpid = int (proc.pid // 1000)
-                if rpid in self.cmdline:
-                    cmd = self.cmdline[rpid]
-                    proc.exe = cmd['exe']
-                    proc.args = cmd['args']
-#                else:
-#                    print "proc %d '%s' not in cmdline" % (rpid, proc.exe)
-
         # re-parent any stray orphans if we can
-        if self.parent_map is not None:
-            for process in self.ps_stats.process_map.values():
+        if parent_map is not None:
+            for process in processes:
                 ppid = find_parent_id_for (int(process.pid // 1000))
                 if ppid:
                     process.ppid = ppid * 1000
 
         # stitch the tree together with pointers
-        for process in self.ps_stats.process_map.values():
-            process.set_parent (self.ps_stats.process_map)
-
-        # count on fingers variously
-        for process in self.ps_stats.process_map.values():
-            process.calc_stats (self.ps_stats.sample_period)
-
-    def crop(self, writer, crop_after):
+        for process in processes:
+            process.set_parent (process_map)
 
-        def is_idle_at(util, start, j):
-            k = j + 1
-            while k < len(util) and util[k][0] < start + 300:
-                k += 1
-            k = min(k, len(util)-1)
-
-            if util[j][1] >= 0.25:
-                return False
-
-            avgload = sum(u[1] for u in util[j:k+1]) / (k-j+1)
-            if avgload < 0.25:
-                return True
-            else:
-                return False
-        def is_idle(util, start):
-            for j in range(0, len(util)):
-                if util[j][0] < start:
-                    continue
-                return is_idle_at(util, start, j)
-            else:
-                return False
+    def crop(self, writer, crop_after, idle_window = 300, idle_threshold = 0.25):
+        """Crops the trace at the end of the first idle period after one
+        of the processes in crop_after started: a time when the cpu load,
+        and the average cpu and disk loads over the following idle_window
+        (in 1/100s), are below idle_threshold.  Returns when it went idle."""
 
         names = [x[:15] for x in crop_after.split(",")]
-        for proc in self.ps_stats.process_map.values():
-            if proc.cmd in names or proc.exe in names:
-                writer.info("selected proc '%s' from list (start %d)"
-                            % (proc.cmd, proc.start_time))
-                break
+        proc = self.proc_index.first(names, exe = True)
         if proc is None:
             writer.warn("no selected crop proc '%s' in list" % crop_after)
+            return None
+        writer.info("selected proc '%s' from list (start %d)"
+                    % (proc.cmd, proc.start_time))
 
-
-        cpu_util = [(sample.time, sample.user + sample.sys + sample.io) for sample in self.cpu_stats]
-        disk_util = [(sample.time, sample.util) for sample in self.disk_stats]
+        cpu_util = _IdleSeries(self.cpu_stats.time, self.cpu_stats.cpu_io)
+        disk_util = _IdleSeries(self.disk_stats.time, self.disk_stats.util)
 
         idle = None
-        for i in range(0, len(cpu_util)):
-            if cpu_util[i][0] < proc.start_time:
-                continue
-            if is_idle_at(cpu_util, cpu_util[i][0], i) \
-               and is_idle(disk_util, cpu_util[i][0]):
-                idle = cpu_util[i][0]
+        for i in range(bisect_left(cpu_util.times, proc.start_time), len(cpu_util.times)):
+            start = cpu_util.times[i]
+            if cpu_util.is_idle_at(i, start, idle_window, idle_threshold) \
+               and disk_util.is_idle(start, idle_window, idle_threshold):
+                idle = start
                 break
 
         if idle is None:
             writer.warn ("not idle after proc '%s'" % crop_after)
             return None
 
-        crop_at = idle + 300
+        crop_at = idle + idle_window
         writer.info ("cropping at time %d" % crop_at)
-        while len (self.cpu_stats) \
-                    and self.cpu_stats[-1].time > crop_at:
-            self.cpu_stats.pop()
-        while len (self.disk_stats) \
-                    and self.disk_stats[-1].time > crop_at:
-            self.disk_stats.pop()
+        self.cpu_stats = self.cpu_stats.until(crop_at)
+        self.disk_stats = self.disk_stats.until(crop_at)
 
         self.ps_stats.end_time = crop_at
 
@@ -209,16 +327,247 @@ class Trace:
 
         for proc in cropped_map.values():
             proc.duration = min (proc.duration, crop_at - proc.start_time)
-            while len (proc.samples) \
-                        and proc.samples[-1].time > crop_at:
-                proc.samples.pop()
+            proc.samples.truncate(crop_at)
 
         self.ps_stats.process_map = cropped_map
+        self._proc_index = None
 
         return idle
 
 
 
+class LiveTrace(Trace):
+    """A Trace of a capture directory which is still being written to,
+    such as the one 'bootchart-collector --dump' keeps refreshing.
+
+    Each poll() parses just the complete blocks appended to the logs
+    since the previous one: the processes and series parsed so far are
+    extended, and only new or updated processes are relinked and have
+    their statistics recounted.  The process tree is rebuilt from copies
+    of the processes, since building it links them together.
+    """
+    def __init__(self, writer, path, options):
+        self._writer = writer
+        self._options = options
+        self._path = path
+        if options.crop_after:
+            writer.warn("warning: --crop-after is ignored when following a capture")
+        self._reset()
+        self.poll()
+        if not self.valid():
+            raise ParseError("empty state: '%s' does not contain a valid bootchart yet" % path)
+
+    def _reset(self):
+        self._needed_logs = set(_LAZY_LOGS)
+        self._pending_logs = {}
+        self._window = None
+        self._cache = None
+        self._kernel_tree = None
+        self._tails = {}
+        self._sample_period = None
+        self.headers = None
+        self.disk_stats = None
+        self.ps_stats = None
+        self.taskstats = None
+        self.cpu_stats = None
+        self.cmdline = None
+        self.kernel = None
+        self.filename = self._path
+        self.parent_map = None
+        self.mem_stats = None
+        self.times = [ None ]
+        self.proc_tree = None
+        self._proc_index = None
+
+    def poll(self):
+        """Parses what was appended to the logs since the last poll,
+        returning whether there was anything."""
+        if not os.path.isdir(self._path):
+            raise ParseError("error: '%s' is not a directory" % self._path)
+        names = sorted(name for name in os.listdir(self._path) if name in _LIVE_LOGS)
+        for name in names:
+            tail = self._tails.get(name)
+            if tail is not None and os.path.getsize(os.path.join(self._path, name)) < tail.offset:
+                self._writer.warn("warning: '%s' was truncated, starting over" % name)
+                self._reset()
+                break
+
+        before = {}
+        if self.ps_stats is not None:
+            before = dict((key, len(proc.samples)) for key, proc in self.ps_stats.process_map.items())
+        self._reparent = set()
+        changed = False
+        for name in names:
+            if self._poll_log(name, os.path.join(self._path, name)):
+                changed = True
+        if changed and self.valid():
+            self._compile_appended(before)
+            self._proc_index = None
+            self.times = self._annotate(self._options.annotate, None)
+            self._build_tree()
+        return changed
+
+    def _poll_log(self, name, filename):
+        tail = self._tails.get(name)
+        if tail is None:
+            tail = self._tails[name] = _LogTail()
+        if name in _HEADER_DEPENDENT_LOGS and self.headers is None:
+            return False
+        with open(filename, "rb") as file:
+            file.seek(tail.offset)
+            data = file.read()
+        if name in ["header", "dmesg"]:
+            # rewritten rather than appended to
+            if not data:
+                return False
+            tail.offset += len(data)
+            with open(filename, "rb") as file:
+                _do_parse(self._writer, self, name, file)
+            self._kernel_tree = None
+            return True
+
+        # only ever parse whole records
+        if name == "kernel_pacct":
+            end = len(data) - len(data) % _ACCT_V3_SIZE
+        else:
+            end = data.rfind(b'\n' if name == "paternity.log" else b'\n\n') + 1
+            if name != "paternity.log" and end > 0:
+                end += 1
+        if end <= 0:
+            return False
+        data = data[:end]
+        tail.offset += end
+        self._writer.status("parsing '%s'" % name)
+
+        if name in ["taskstats.log", "proc_ps.log"]:
+            if tail.process is None:
+                tail.process = _ProcessLogTail()
+            parse = _parse_taskstats_log if name == "taskstats.log" else _parse_proc_ps_log
+            result = parse(self._writer, io.BytesIO(data), tail.process)
+            if result is not None:
+                _store_log(self, name, result)
+        elif name in ["proc_stat.log", "proc_diskstats.log"]:
+            # the deltas of the first new block are taken from the last old one
+            result = _parse_log(self._writer, name, io.BytesIO(tail.lead + data),
+                                get_num_cpus(self.headers))
+            start = data.rfind(b'\n\n', 0, len(data) - 2)
+            tail.lead = data[start + 2:] if start >= 0 else data
+            current = self.cpu_stats if name == "proc_stat.log" else self.disk_stats
+            if current is None:
+                _store_log(self, name, result)
+            else:
+                current.extend(result)
+        elif name == "proc_meminfo.log":
+            result = _parse_proc_meminfo_log(io.BytesIO(data))
+            if self.mem_stats is None:
+                self.mem_stats = result
+            else:
+                self.mem_stats.extend(result)
+        elif name == "cmdline2.log":
+            result = _parse_cmdline_log(self._writer, io.BytesIO(data))
+            if self.cmdline is None:
+                self.cmdline = result
+            else:
+                self.cmdline.update(result)
+            if self.ps_stats is not None:
+                self._merge_cmdline()
+        else:
+            result = _parse_log(self._writer, name, io.BytesIO(data), 1)
+            if result is None:
+                return True
+            if self.parent_map is None:
+                self.parent_map = result
+            else:
+                self.parent_map.update(result)
+            self._reparent.update(result)
+        return True
+
+    def _compile_appended(self, before):
+        process_map = self.ps_stats.process_map
+        period = self.ps_stats.sample_period
+
+        new = [proc for key, proc in process_map.items() if key not in before]
+        if self.cmdline is not None:
+            for proc in new:
+                cmd = self.cmdline.get(int(proc.pid // 1000))
+                if cmd is not None:
+                    proc.exe = cmd['exe']
+                    proc.args = cmd['args']
+        if new or self._reparent:
+            # which ancestor a process is hung from depends on the
+            # processes seen so far, so relink them all
+            self._link_processes(process_map.values())
+
+        for key, proc in process_map.items():
+            if before.get(key) != len(proc.samples):
+                proc.calc_stats(period)
+            elif proc.samples and period != self._sample_period:
+                # only the average sample period moved on
+                proc.duration = proc.samples.time[-1] - proc.start_time + period
+        self._sample_period = period
+
+    def _build_tree(self):
+        process_map = self.ps_stats.process_map
+        copies = dict((proc, proc.copy(share_samples = True)) for proc in process_map.values())
+        for proc, copy in copies.items():
+            if proc.parent is not None:
+                copy.parent = copies.get(proc.parent)
+        kernel = None
+        if self.kernel is not None:
+            kernel = [proc.copy(share_samples = True) for proc in self.kernel]
+        ps_stats = ProcessStats(self._writer,
+                                dict((key, copies[proc]) for key, proc in process_map.items()),
+                                self.ps_stats.sample_count,
+                                self.ps_stats.sample_period, self.ps_stats.start_time,
+                                self.ps_stats.end_time)
+        # keep to the view picked since
+        prune = self._options.prune if self.proc_tree is None else self.proc_tree.pruned
+        self.proc_tree = ProcessTree(self._writer, kernel, ps_stats,
+                                     ps_stats.sample_period,
+                                     self.headers.get("profile.process"),
+                                     prune, None, self.taskstats,
+                                     self.parent_map is not None)
+
+# the logs a LiveTrace follows
+_LIVE_LOGS = set(['header', 'dmesg', 'taskstats.log', 'proc_ps.log', 'proc_stat.log',
+                  'proc_diskstats.log', 'proc_meminfo.log', 'cmdline2.log',
+                  'paternity.log', 'kernel_pacct'])
+
+class _LogTail:
+    """How far a LiveTrace got through one of the logs."""
+    def __init__(self):
+        self.offset = 0
+        # the last block, for logs of counters
+        self.lead = b''
+        # a _ProcessLogTail, for process logs
+        self.process = None
+
+class _IdleSeries:
+    """A series of loads, with the running sums that give the average
+    load over any stretch of it at once."""
+    def __init__(self, times, loads):
+        self.times = column_list(times)
+        self.loads = column_list(loads)
+        self.sums = [0.0]
+        for load in self.loads:
+            self.sums.append(self.sums[-1] + load)
+
+    def is_idle_at(self, j, start, window, threshold):
+        """Whether the j-th load, and the average load from there to the
+        first sample taken window after start, are below threshold."""
+        if self.loads[j] >= threshold:
+            return False
+        k = min(bisect_left(self.times, start + window, j + 1), len(self.times) - 1)
+        return (self.sums[k + 1] - self.sums[j]) / (k - j + 1) < threshold
+
+    def is_idle(self, start, window, threshold):
+        """Whether the series is idle from the first sample taken at start
+        or later on."""
+        j = bisect_left(self.times, start)
+        if j == len(self.times):
+            return False
+        return self.is_idle_at(j, start, window, threshold)
+
 class ParseError(Exception):
     """Represents errors during parse of the bootchart."""
     def __init__(self, value):
@@ -239,6 +588,142 @@ def _parse_headers(file):
         return headers, last
     return reduce(parse, file.read().decode('utf-8').split('\n'), (defaultdict(str),''))[0]
 
+# logs which cannot be mapped are read this much at a time
+_READ_SIZE = 1024 * 1024
+
+def _map_file(file):
+    """Returns the contents of file memory-mapped, or None when it is not
+    a real file (an archive member) or is empty."""
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        return None
+
+def _iter_raw_blocks(file):
+    """Yields the bytes between the blank lines of file, scanning a
+    memory map of it or, failing that, large chunks read from it."""
+    data = _map_file(file)
+    if data is not None:
+        try:
+            start = 0
+            end = data.find(b'\n\n')
+            while end >= 0:
+                yield data[start:end]
+                start = end + 2
+                end = data.find(b'\n\n', start)
+            yield data[start:]
+        finally:
+            data.close()
+        return
+
+    tail = b''
+    while True:
+        chunk = file.read(_READ_SIZE)
+        if not chunk:
+            break
+        data = tail + chunk if tail else chunk
+        start = 0
+        end = data.find(b'\n\n')
+        while end >= 0:
+            yield data[start:end]
+            start = end + 2
+            end = data.find(b'\n\n', start)
+        tail = data[start:]
+    yield tail
+
+# timed-block logs which can be cut down to a time window; the blocks of
+# cmdline2.log are keyed by pid
+_WINDOWED_LOGS = set(['proc_stat.log', 'proc_diskstats.log', 'proc_meminfo.log',
+                      'taskstats.log', 'proc_ps.log'])
+# ... and those holding counters, whose first delta is taken from the
+# block before the window
+_DELTA_LOGS = _WINDOWED_LOGS - set(['proc_meminfo.log'])
+
+def _index_timed_blocks(data):
+    """Returns the timestamps and byte offsets of the timed blocks in data,
+    the offsets ending with the size of data; or None if the timestamps
+    are not in order."""
+    times = array('q')
+    offsets = array('q')
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(b'\n\n', start)
+        if end < 0:
+            end = size
+        head = data[start:min(end, start + 64)].split(None, 1)
+        if head:
+            try:
+                time = int(head[0])
+            except ValueError:
+                return None
+            if times and time < times[-1]:
+                return None
+            times.append(time)
+            offsets.append(start)
+        start = end + 2
+    offsets.append(size)
+    return times, offsets
+
+def _window_range(index, window, lead):
+    """Returns the byte range of the blocks inside the window, preceded by
+    the block the first deltas are taken from if lead is set."""
+    times, offsets = index
+    start, end = window
+    first = 0 if start is None else bisect_left(times, start)
+    if lead:
+        first = max(first - 1, 0)
+    last = len(times) if end is None else bisect_right(times, end)
+    last = min(max(last, first + 1), len(times))
+    return offsets[first], offsets[last]
+
+def _read_range(file, start, end):
+    data = _map_file(file)
+    if data is not None:
+        try:
+            return data[start:end]
+        finally:
+            data.close()
+    length = end - start
+    while start > 0:
+        skipped = file.read(min(start, _READ_SIZE))
+        if not skipped:
+            return b''
+        start -= len(skipped)
+    return file.read(length)
+
+def _window_log(writer, state, name, file, origin):
+    """Returns the blocks of the timed-block log in file which fall inside
+    the window of state, or None to parse the whole of it.
+
+    The block index of the log is kept in the cache, under the origin of
+    the log ('path', filename) or ('tar', archive, member).
+    """
+    if state._window is None or name not in _WINDOWED_LOGS:
+        return None
+    cache = state._cache if origin is not None else None
+    index = cache.load_index(origin) if cache is not None else None
+    if index is not None:
+        start, end = _window_range(index, state._window, name in _DELTA_LOGS)
+        return _read_range(file, start, end)
+
+    data = _map_file(file)
+    mapped = data is not None
+    if not mapped:
+        data = file.read()
+    try:
+        index = _index_timed_blocks(data)
+        if index is None:
+            writer.warn("warning: timestamps of '%s' are out of order, loading all of it" % name)
+            return None if mapped else data
+        if cache is not None:
+            cache.store_index(origin, *index)
+        start, end = _window_range(index, state._window, name in _DELTA_LOGS)
+        return data[start:end]
+    finally:
+        if mapped:
+            data.close()
+
 def _iter_parse_timed_blocks(file):
     """Parses (ie., splits) a file into so-called timed-blocks.
 
@@ -246,7 +731,8 @@ def _iter_parse_timed_blocks(file):
     by zero or more lines of data for that point in time.
 
     Return an iterator over timed blocks, so there is no need to keep
-    all the data in memory.
+    all the data in memory.  The data lines are stripped bytes; parsers
+    decode only the fields which hold text.
     """
     def parse(block):
         lines = block
@@ -255,30 +741,34 @@ def _iter_parse_timed_blocks(file):
         try:
             return (int(lines[0]), lines[1:])
         except ValueError:
-            raise ParseError("expected a timed-block, but timestamp '%s' is not an integer" % lines[0])
-    data = codecs.iterdecode(file, "utf-8")
-    block = [line.strip() for line in itertools.takewhile(lambda s: s != "\n", data)]
-    while block:
-        if block and not block[-1].endswith(" not running\n"):
+            raise ParseError("expected a timed-block, but timestamp '%s' is not an integer"
+                             % lines[0].decode('utf-8', 'replace'))
+    for raw in _iter_raw_blocks(file):
+        block = []
+        for line in raw.split(b'\n'):
+            line = line.strip()
+            if line:
+                block.append(line)
+                continue
+            # blank lines terminate the block too; runs of them are harmless
+            if block and not block[-1].endswith(b" not running"):
+                yield parse(block)
+            block = []
+        if block and not block[-1].endswith(b" not running"):
             yield parse(block)
-        block = [line.strip() for line in itertools.takewhile(lambda s: s != "\n", data)]
 
-def _parse_timed_blocks(file):
-    """Parses (ie., splits) a file into so-called timed-blocks. A
-    timed-block consists of a timestamp on a line by itself followed
-    by zero or more lines of data for that point in time."""
-    def parse(block):
-        lines = block.split('\n')
-        if not lines:
-            raise ParseError('expected a timed-block consisting a timestamp followed by data lines')
-        try:
-            return (int(lines[0]), lines[1:])
-        except ValueError:
-            raise ParseError("expected a timed-block, but timestamp '%s' is not an integer" % lines[0])
-    blocks = file.read().decode('utf-8').split('\n\n')
-    return [parse(block) for block in blocks if block.strip() and not block.endswith(' not running\n')]
-
-def _parse_proc_ps_log(writer, file):
+class _ProcessLogTail:
+    """What the parser of a process log carries over to the blocks
+    appended to the log later on."""
+    def __init__(self):
+        self.process_map = {}
+        self.pid_rewrites = {}
+        self.names = {}
+        self.start_time = None
+        self.ltime = None
+        self.count = 0
+
+def _parse_proc_ps_log(writer, file, tail=None):
     """
      * See proc(5) for details.
      *
@@ -286,47 +776,53 @@ def _parse_proc_ps_log(writer, file):
      *  cutime, cstime, priority, nice, 0, itrealvalue, starttime, vsize, rss, rlim, startcode, endcode, startstack,
      *  kstkesp, kstkeip}
     """
-    timed_blocks = _iter_parse_timed_blocks(file)
-    try:
-        first_timed_block = next(timed_blocks)
-        startTime = first_timed_block[0]
-    except StopIteration:
-        return None
-
-    processMap = {}
-    ltime = 0
-    timed_blocks_count = 0
-    for time, lines in itertools.chain((first_timed_block,), timed_blocks):
+    if tail is None:
+        tail = _ProcessLogTail()
+    processMap = tail.process_map
+    names = tail.names
+    startTime = tail.start_time
+    ltime = tail.ltime if tail.ltime is not None else 0
+    timed_blocks_count = tail.count
+    for time, lines in _iter_parse_timed_blocks(file):
+        if startTime is None:
+            startTime = time
         timed_blocks_count += 1
         for line in lines:
             if not line: continue
-            tokens = line.split(' ')
+            tokens = line.split(b' ')
             if len(tokens) < 21:
                 continue
 
-            offset = [index for index, token in enumerate(tokens[1:]) if token[-1] == ')'][0]
-            pid, cmd, state, ppid = int(tokens[0]), ' '.join(tokens[1:2+offset]), tokens[2+offset], int(tokens[3+offset])
+            offset = next((index for index, token in enumerate(tokens[1:]) if token.endswith(b')')), None)
+            if offset is None:
+                continue
+            pid, cmd, state, ppid = int(tokens[0]), b' '.join(tokens[1:2+offset]), tokens[2+offset], int(tokens[3+offset])
             userCpu, sysCpu, stime = int(tokens[13+offset]), int(tokens[14+offset]), int(tokens[21+offset])
 
             # magic fixed point-ness ...
             pid *= 1000
             ppid *= 1000
+            # decode every distinct name only once
+            if cmd in names:
+                cmd = names[cmd]
+            else:
+                cmd = names[cmd] = intern(cmd.strip(b'()').decode('utf-8', 'replace'))
             if pid in processMap:
                 process = processMap[pid]
-                process.cmd = cmd.strip('()') # why rename after latest name??
+                process.cmd = cmd # why rename after latest name??
             else:
-                process = Process(writer, pid, cmd.strip('()'), ppid, min(time, stime))
+                process = Process(writer, pid, cmd, ppid, min(time, stime))
                 processMap[pid] = process
 
             if process.last_user_cpu_time is not None and process.last_sys_cpu_time is not None and ltime is not None:
                 userCpuLoad, sysCpuLoad = process.calc_load(userCpu, sysCpu, max(1, time - ltime))
-                cpuSample = CPUSample('null', userCpuLoad, sysCpuLoad, 0.0)
-                process.samples.append(ProcessSample(time, state, cpuSample))
+                process.samples.append(time, state, userCpuLoad, sysCpuLoad, 0.0)
 
             process.last_user_cpu_time = userCpu
             process.last_sys_cpu_time = sysCpu
         ltime = time
 
+    tail.start_time, tail.ltime, tail.count = startTime, ltime, timed_blocks_count
     if timed_blocks_count < 2:
         return None
 
@@ -334,27 +830,33 @@ def _parse_proc_ps_log(writer, file):
 
     return ProcessStats (writer, processMap, timed_blocks_count, avgSampleLength, startTime, ltime)
 
-def _parse_taskstats_log(writer, file):
+def _parse_taskstats_log(writer, file, tail=None):
     """
      * See bootchart-collector.c for details.
      *
      * { pid, ppid, comm, cpu_run_real_total, blkio_delay_total, swapin_delay_total }
      *
     """
-    processMap = {}
-    pidRewrites = {}
-    ltime = None
-    timed_blocks = _parse_timed_blocks(file)
-    for time, lines in timed_blocks:
+    if tail is None:
+        tail = _ProcessLogTail()
+    processMap = tail.process_map
+    pidRewrites = tail.pid_rewrites
+    names = tail.names
+    ltime = tail.ltime
+    startTime = tail.start_time
+    timed_blocks_count = tail.count
+    for time, lines in _iter_parse_timed_blocks(file):
+        timed_blocks_count += 1
         # we have no 'stime' from taskstats, so prep 'init'
         if ltime is None:
             process = Process(writer, 1, '[init]', 0, 0)
             processMap[1000] = process
+            startTime = time
             ltime = time
 #                       continue
         for line in lines:
             if not line: continue
-            tokens = line.split(' ')
+            tokens = line.split(b' ')
             if len(tokens) != 6:
                 continue
 
@@ -371,7 +873,11 @@ def _parse_taskstats_log(writer, file):
             else:
                 pid = opid
 
-            cmd = cmd.strip('(').strip(')')
+            # decode every distinct name only once
+            if cmd in names:
+                cmd = names[cmd]
+            else:
+                cmd = names[cmd] = intern(cmd.strip(b'(').strip(b')').decode('utf-8', 'replace'))
             if pid in processMap:
                 process = processMap[pid]
                 if process.cmd != cmd:
@@ -402,28 +908,27 @@ def _parse_taskstats_log(writer, file):
             # with the old-style to be a %age of CPU used in this time-slice.
             if delta_cpu_ns + delta_blkio_delay_ns + delta_swapin_delay_ns > 0:
 #                               print "proc %s cpu_ns %g delta_cpu %g" % (cmd, cpu_ns, delta_cpu_ns)
-                cpuSample = CPUSample('null', delta_cpu_ns, 0.0,
-                                      delta_blkio_delay_ns,
-                                      delta_swapin_delay_ns)
-                process.samples.append(ProcessSample(time, state, cpuSample))
+                process.samples.append(time, state, delta_cpu_ns, 0.0,
+                                       delta_blkio_delay_ns,
+                                       delta_swapin_delay_ns)
 
             process.last_cpu_ns = cpu_ns
             process.last_blkio_delay_ns = blkio_delay_ns
             process.last_swapin_delay_ns = swapin_delay_ns
         ltime = time
 
-    if len (timed_blocks) < 2:
+    tail.start_time, tail.ltime, tail.count = startTime, ltime, timed_blocks_count
+    if timed_blocks_count < 2:
         return None
 
-    startTime = timed_blocks[0][0]
-    avgSampleLength = (ltime - startTime)/(len(timed_blocks)-1)
+    avgSampleLength = (ltime - startTime)/(timed_blocks_count - 1)
 
-    return ProcessStats (writer, processMap, len (timed_blocks), avgSampleLength, startTime, ltime)
+    return ProcessStats (writer, processMap, timed_blocks_count, avgSampleLength, startTime, ltime)
 
 def _parse_proc_stat_log(file):
-    samples = []
-    ltimes = None
-    for time, lines in _parse_timed_blocks(file):
+    timestamps = []
+    rows = []
+    for time, lines in _iter_parse_timed_blocks(file):
         # skip emtpy lines
         if not lines:
             continue
@@ -431,7 +936,25 @@ def _parse_proc_stat_log(file):
         if len(tokens) < 8:
             continue
         # CPU times {user, nice, system, idle, io_wait, irq, softirq}
-        times = [ int(token) for token in tokens[1:] ]
+        timestamps.append(time)
+        rows.append(tokens[1:8])
+        # skip the rest of statistics lines
+
+    if numpy is not None and len(rows) > 1:
+        times = numpy.array(rows, dtype=numpy.int64)
+        deltas = numpy.diff(times, axis=0)
+        user = (deltas[:, 0] + deltas[:, 1]).astype(numpy.float64)
+        system = (deltas[:, 2] + deltas[:, 5] + deltas[:, 6]).astype(numpy.float64)
+        idle = deltas[:, 3].astype(numpy.float64)
+        iowait = deltas[:, 4].astype(numpy.float64)
+        aSum = numpy.maximum(user + system + idle + iowait, 1)
+        return CPUStats(numpy.array(timestamps[1:], dtype=numpy.int64),
+                        user/aSum, system/aSum, iowait/aSum)
+
+    samples = ([], [], [], [])
+    ltimes = None
+    for time, row in zip(timestamps, rows):
+        times = [ int(token) for token in row ]
         if ltimes:
             user = float((times[0] + times[1]) - (ltimes[0] + ltimes[1]))
             system = float((times[2] + times[5] + times[6]) - (ltimes[2] + ltimes[5] + ltimes[6]))
@@ -439,11 +962,11 @@ def _parse_proc_stat_log(file):
             iowait = float(times[4] - ltimes[4])
 
             aSum = max(user + system + idle + iowait, 1)
-            samples.append( CPUSample(time, user/aSum, system/aSum, iowait/aSum) )
+            for column, value in zip(samples, (time, user/aSum, system/aSum, iowait/aSum)):
+                column.append(value)
 
         ltimes = times
-        # skip the rest of statistics lines
-    return samples
+    return CPUStats(to_column(samples[0], True), *[to_column(c) for c in samples[1:]])
 
 def _parse_proc_disk_stat_log(file, numCpu):
     """
@@ -451,7 +974,7 @@ def _parse_proc_disk_stat_log(file, numCpu):
     not sda1, sda2 etc. The format of relevant lines should be:
     {major minor name rio rmerge rsect ruse wio wmerge wsect wuse running use aveq}
     """
-    disk_regex_re = re.compile ('^([hsv]d.|mtdblock\d|mmcblk\d|cciss/c\d+d\d+.*)$')
+    disk_regex_re = re.compile (br'^([hsv]d.|mtdblock\d|mmcblk\d|cciss/c\d+d\d+.*)$')
 
     # this gets called an awful lot.
     def is_relevant_line(linetokens):
@@ -460,9 +983,38 @@ def _parse_proc_disk_stat_log(file, numCpu):
         disk = linetokens[2]
         return disk_regex_re.match(disk)
 
-    disk_stat_samples = []
-
-    for time, lines in _parse_timed_blocks(file):
+    if numpy is not None:
+        # gather {rsect, wsect, use} of every relevant line, tagged with
+        # the index of its block, and sum them per block in one go
+        timestamps = []
+        blocks = []
+        rows = []
+        for time, lines in _iter_parse_timed_blocks(file):
+            for tokens in map (lambda x: x.split(), lines):
+                if is_relevant_line(tokens):
+                    blocks.append(len(timestamps))
+                    rows.append((tokens[5], tokens[9], tokens[12]))
+            timestamps.append(time)
+
+        diskdata = numpy.zeros((len(timestamps), 3), dtype=numpy.int64)
+        if rows:
+            numpy.add.at(diskdata, blocks, numpy.array(rows, dtype=numpy.int64))
+        times = numpy.array(timestamps, dtype=numpy.int64)
+        interval = times[:-1] - times[1:]
+        interval[interval == 0] = 1
+        sums = diskdata[:-1] - diskdata[1:]
+        readTput = sums[:, 0] / 2.0 * 100.0 / interval
+        writeTput = sums[:, 1] / 2.0 * 100.0 / interval
+        util = sums[:, 2].astype(numpy.float64) / 10 / interval / numCpu
+        # adding 0.0 turns -0.0 into 0.0, as max() does below
+        util = numpy.clip(util, 0.0, 1.0) + 0.0
+        return DiskStats(times[1:], readTput, writeTput, util)
+
+    disk_stats = ([], [], [], [])
+    # only the previous sample is needed to compute the deltas
+    last_sample = None
+
+    for time, lines in _iter_parse_timed_blocks(file):
         sample = DiskStatSample(time)
         relevant_tokens = [linetokens for linetokens in map (lambda x: x.split(),lines) if is_relevant_line(linetokens)]
 
@@ -470,21 +1022,20 @@ def _parse_proc_disk_stat_log(file, numCpu):
             disk, rsect, wsect, use = tokens[2], int(tokens[5]), int(tokens[9]), int(tokens[12])
             sample.add_diskdata([rsect, wsect, use])
 
-        disk_stat_samples.append(sample)
-
-    disk_stats = []
-    for sample1, sample2 in zip(disk_stat_samples[:-1], disk_stat_samples[1:]):
-        interval = sample1.time - sample2.time
-        if interval == 0:
-            interval = 1
-        sums = [ a - b for a, b in zip(sample1.diskdata, sample2.diskdata) ]
-        readTput = sums[0] / 2.0 * 100.0 / interval
-        writeTput = sums[1] / 2.0 * 100.0 / interval
-        util = float( sums[2] ) / 10 / interval / numCpu
-        util = max(0.0, min(1.0, util))
-        disk_stats.append(DiskSample(sample2.time, readTput, writeTput, util))
-
-    return disk_stats
+        if last_sample is not None:
+            interval = last_sample.time - sample.time
+            if interval == 0:
+                interval = 1
+            sums = [ a - b for a, b in zip(last_sample.diskdata, sample.diskdata) ]
+            readTput = sums[0] / 2.0 * 100.0 / interval
+            writeTput = sums[1] / 2.0 * 100.0 / interval
+            util = float( sums[2] ) / 10 / interval / numCpu
+            util = max(0.0, min(1.0, util))
+            for column, value in zip(disk_stats, (sample.time, readTput, writeTput, util)):
+                column.append(value)
+        last_sample = sample
+
+    return DiskStats(to_column(disk_stats[0], True), *[to_column(c) for c in disk_stats[1:]])
 
 def _parse_proc_meminfo_log(file):
     """
@@ -492,15 +1043,15 @@ def _parse_proc_meminfo_log(file):
     The format of relevant lines should be: ^key: value( unit)?
     """
     mem_stats = []
-    meminfo_re = re.compile(r'(MemTotal|MemFree|Buffers|Cached|SwapTotal|SwapFree):\s*(\d+).*')
+    meminfo_re = re.compile(br'(MemTotal|MemFree|Buffers|Cached|SwapTotal|SwapFree):\s*(\d+).*')
 
-    for time, lines in _parse_timed_blocks(file):
+    for time, lines in _iter_parse_timed_blocks(file):
         sample = MemSample(time)
 
         for line in lines:
             match = meminfo_re.match(line)
             if match:
-                sample.add_value(match.group(1), int(match.group(2)))
+                sample.add_value(match.group(1).decode('ascii'), int(match.group(2)))
 
         if sample.valid():
             mem_stats.append(sample)
@@ -584,34 +1135,51 @@ def _parse_dmesg(writer, file):
         elif type == "async_waiting" or type == "async_continuing":
             continue # ignore
 
-    return processMap.values()
+    return list(processMap.values())
 
 #
 # Parse binary pacct accounting file output if we have one
 # cf. /usr/include/linux/acct.h
 #
+# struct acct_v3 is 64 bytes: flag, version, tty, exitcode, uid, gid,
+# then the pid and ppid we are after, followed by the timings and comm.
+_ACCT_V3_SIZE = 64
+_ACCT_V3_VERSION = 3
+_ACCT_BYTEORDER = 0x80 # set in the version of big endian records
+
 def _parse_pacct(writer, file):
-    # read LE int32
-    def _read_le_int32(file):
-        byts = file.read(4)
-        return (ord(byts[0]))       | (ord(byts[1]) << 8) | \
-               (ord(byts[2]) << 16) | (ord(byts[3]) << 24)
+    data = _map_file(file)
+    if data is None:
+        return _decode_pacct(writer, file.read())
+    try:
+        return _decode_pacct(writer, data)
+    finally:
+        data.close()
+
+def _decode_pacct(writer, data):
+    count, trailing = divmod(len(data), _ACCT_V3_SIZE)
+    if trailing:
+        writer.warn("warning: ignoring %d trailing bytes of kernel_pacct" % trailing)
+
+    versions = bytearray(data[1:count * _ACCT_V3_SIZE:_ACCT_V3_SIZE])
+    byteorder = versions[0] & _ACCT_BYTEORDER if versions else 0
+    for ver in versions:
+        if ver & ~_ACCT_BYTEORDER < _ACCT_V3_VERSION or ver & _ACCT_BYTEORDER != byteorder:
+            writer.warn("Invalid version 0x%x" % ver)
+            return None
 
+    record = struct.Struct(('>' if byteorder else '<') + '16xII40x')
     parent_map = {}
     parent_map[0] = 0
-    while file.read(1) != "": # ignore flags
-        ver = file.read(1)
-        if ord(ver) < 3:
-            print("Invalid version 0x%x" % (ord(ver)))
-            return None
-
-        file.seek (14, 1)     # user, group etc.
-        pid = _read_le_int32 (file)
-        ppid = _read_le_int32 (file)
-#               print "Parent of %d is %d" % (pid, ppid)
-        parent_map[pid] = ppid
-        file.seek (4 + 4 + 16, 1) # timings
-        file.seek (16, 1)         # acct_comm
+    view = memoryview(data)[:count * _ACCT_V3_SIZE]
+    try:
+        if hasattr(record, 'iter_unpack'):
+            parent_map.update(record.iter_unpack(view))
+        else:
+            parent_map.update(record.unpack_from(view, offset)
+                              for offset in range(0, len(view), record.size))
+    finally:
+        view.release()
     return parent_map
 
 def _parse_paternity_log(writer, file):
@@ -630,16 +1198,15 @@ def _parse_paternity_log(writer, file):
 
 def _parse_cmdline_log(writer, file):
     cmdLines = {}
-    for block in file.read().decode('utf-8').split('\n\n'):
-        lines = block.split('\n')
-        if len (lines) >= 3:
+    # blocks are keyed by pid rather than time, but share the layout
+    for pid, lines in _iter_parse_timed_blocks(file):
+        if len (lines) >= 2:
 #                       print "Lines '%s'" % (lines[0])
-            pid = int (lines[0])
             values = {}
-            values['exe'] = lines[1].lstrip(':')
-            args = lines[2].lstrip(':').split('\0')
+            values['exe'] = lines[0].lstrip(b':').decode('utf-8', 'replace')
+            args = lines[1].lstrip(b':').split(b'\0')
             args.pop()
-            values['args'] = args
+            values['args'] = [arg.decode('utf-8', 'replace') for arg in args]
             cmdLines[pid] = values
     return cmdLines
 
@@ -659,42 +1226,238 @@ def get_num_cpus(headers):
         return 1
     return max (int(mat.group(1)), 1)
 
-def _do_parse(writer, state, name, file):
-    writer.status("parsing '%s'" % name)
-    t1 = perf_counter()
+# logs which can only be parsed once the header has been seen
+_HEADER_DEPENDENT_LOGS = set(['proc_diskstats.log'])
+
+def _parse_log(writer, name, file, num_cpus):
+    """Runs the parser matching the log called 'name' and returns its result."""
     if name == "header":
-        state.headers = _parse_headers(file)
+        return _parse_headers(file)
     elif name == "proc_diskstats.log":
-        state.disk_stats = _parse_proc_disk_stat_log(file, get_num_cpus(state.headers))
+        return _parse_proc_disk_stat_log(file, num_cpus)
     elif name == "taskstats.log":
-        state.ps_stats = _parse_taskstats_log(writer, file)
-        state.taskstats = True
+        return _parse_taskstats_log(writer, file)
     elif name == "proc_stat.log":
-        state.cpu_stats = _parse_proc_stat_log(file)
+        return _parse_proc_stat_log(file)
     elif name == "proc_meminfo.log":
-        state.mem_stats = _parse_proc_meminfo_log(file)
+        return _parse_proc_meminfo_log(file)
     elif name == "dmesg":
-        state.kernel = _parse_dmesg(writer, file)
+        return _parse_dmesg(writer, file)
     elif name == "cmdline2.log":
-        state.cmdline = _parse_cmdline_log(writer, file)
+        return _parse_cmdline_log(writer, file)
     elif name == "paternity.log":
-        state.parent_map = _parse_paternity_log(writer, file)
+        return _parse_paternity_log(writer, file)
     elif name == "proc_ps.log":  # obsoleted by TASKSTATS
-        state.ps_stats = _parse_proc_ps_log(writer, file)
+        return _parse_proc_ps_log(writer, file)
     elif name == "kernel_pacct": # obsoleted by PROC_EVENTS
-        state.parent_map = _parse_pacct(writer, file)
+        return _parse_pacct(writer, file)
+    return None
+
+def _store_log(state, name, result):
+    """Stores the result of parsing the log called 'name' into the state."""
+    if name in ["taskstats.log", "proc_ps.log"] and result is not None \
+       and state._window is not None and state._window[0] is not None:
+        # the block before the window only primes the counters
+        for proc in result.process_map.values():
+            proc.samples.drop_before(state._window[0])
+    if name == "header":
+        state.headers = result
+    elif name == "proc_diskstats.log":
+        state.disk_stats = result
+    elif name == "taskstats.log":
+        state.ps_stats = result
+        state.taskstats = True
+    elif name == "proc_stat.log":
+        state.cpu_stats = result
+    elif name == "proc_meminfo.log":
+        state.mem_stats = result
+    elif name == "dmesg":
+        state.kernel = result
+    elif name == "cmdline2.log":
+        state.cmdline = result
+    elif name == "paternity.log":
+        state.parent_map = result
+    elif name == "proc_ps.log":
+        state.ps_stats = result
+    elif name == "kernel_pacct":
+        state.parent_map = result
+
+def _do_parse(writer, state, name, file, origin=None):
+    writer.status("parsing '%s'" % name)
+    t1 = perf_counter()
+    window = _window_log(writer, state, name, file, origin)
+    if window is not None:
+        file = io.BytesIO(window)
+    _store_log(state, name, _parse_log(writer, name, file, get_num_cpus(state.headers)))
+    t2 = perf_counter()
+    writer.info("  %s seconds" % str(t2-t1))
+    return state
+
+# logs worth handing to a worker process; anything else is parsed inline
+_POOLED_LOGS = set(['proc_diskstats.log', 'taskstats.log', 'proc_stat.log',
+                    'proc_meminfo.log', 'dmesg', 'cmdline2.log',
+                    'paternity.log', 'proc_ps.log', 'kernel_pacct'])
+
+class _DeferredWriter:
+    """Records the messages of a worker process, to be replayed later."""
+    def __init__(self):
+        self.messages = []
+
+    def error(self, msg):
+        self.messages.append(('error', msg))
+
+    def warn(self, msg):
+        self.messages.append(('warn', msg))
+
+    def info(self, msg):
+        self.messages.append(('info', msg))
+
+    def status(self, msg):
+        self.messages.append(('status', msg))
+
+    def replay(self, writer):
+        for level, msg in self.messages:
+            getattr(writer, level)(msg)
+
+def _parse_log_job(name, source, num_cpus):
+    """Process pool entry point: 'source' is either ('path', filename) or
+    ('data', bytes) for a member already read from an archive."""
+    writer = _DeferredWriter()
+    t1 = perf_counter()
+    kind, value = source
+    if kind == 'path':
+        with open(value, "rb") as file:
+            result = _parse_log(writer, name, file, num_cpus)
+    else:
+        result = _parse_log(writer, name, io.BytesIO(value), num_cpus)
     t2 = perf_counter()
     writer.info("  %s seconds" % str(t2-t1))
+    return result, writer
+
+class _ParsePool:
+    """Dispatches the parsing of logs to a process pool.
+
+    The results are stored into the state in submission order, so the
+    outcome is the same as parsing the logs one after another.
+    """
+    def __init__(self, writer, state, executor):
+        self.writer = writer
+        self.state = state
+        self.executor = executor
+        self.pending = []
+
+    def submit(self, name, source, origin=None):
+        kind, value = source
+        if name not in _POOLED_LOGS:
+            # the header is tiny, and needed by the disk stats
+            if kind == 'path':
+                with open(value, "rb") as file:
+                    return _do_parse(self.writer, self.state, name, file, origin)
+            return _do_parse(self.writer, self.state, name, io.BytesIO(value), origin)
+        if self.state._window is not None and name in _WINDOWED_LOGS:
+            # cut the log down here, where its block index is cached
+            file = open(value, "rb") if kind == 'path' else io.BytesIO(value)
+            with file:
+                window = _window_log(self.writer, self.state, name, file, origin)
+            if window is not None:
+                source = ('data', window)
+        self.writer.status("parsing '%s'" % name)
+        future = self.executor.submit(_parse_log_job, name, source,
+                                      get_num_cpus(self.state.headers))
+        self.pending.append((name, future))
+        return self.state
+
+    def finish(self):
+        for name, future in self.pending:
+            result, deferred = future.result()
+            deferred.replay(self.writer)
+            # processes built in a worker point at its deferred writer
+            if name in ["taskstats.log", "proc_ps.log"] and result is not None:
+                for proc in result.process_map.values():
+                    proc.writer = self.writer
+            elif name == "dmesg":
+                for proc in result:
+                    proc.writer = self.writer
+            _store_log(self.state, name, result)
+        self.pending = []
+        return self.state
+
+def _defer_log(state, name, source):
+    """Sets a log aside, to be parsed when its part of the trace is first
+    used, unless the output needs it anyway."""
+    if name not in _LAZY_LOGS or name in state._needed_logs:
+        return False
+    state._pending_logs[name] = source
+    return True
+
+def _parse_pending_log(writer, state, name, source):
+    if source[0] == 'path':
+        with open(source[1], "rb") as file:
+            return _do_parse(writer, state, name, file, source)
+    path, member_name = source[1:]
+    tf = None
+    try:
+        tf = tarfile.open(path, 'r|*')
+        for member in tf:
+            if member.name == member_name:
+                return _do_parse(writer, state, name, tf.extractfile(member), source)
+    except tarfile.ReadError as error:
+        raise ParseError("error: could not read tarfile '%s': %s." % (path, error))
+    finally:
+        if tf != None:
+            tf.close()
     return state
 
-def parse_file(writer, state, filename):
+def parse_file(writer, state, filename, pool=None):
     if state.filename is None:
         state.filename = filename
     basename = os.path.basename(filename)
+    origin = ('path', os.path.abspath(filename))
+    if _defer_log(state, basename, origin):
+        return state
+    if pool is not None:
+        return pool.submit(basename, ('path', filename), origin)
     with open(filename, "rb") as file:
-        return _do_parse(writer, state, basename, file)
+        return _do_parse(writer, state, basename, file, origin)
+
+def parse_tarfile(writer, state, path, pool=None):
+    """Parses a (compressed) tar archive in a single streaming pass.
 
-def parse_paths(writer, state, paths):
+    Each member is handed to its parser while it is being decompressed,
+    so the archive is never rewound.  Members that depend on data which
+    has not been seen yet (the header) are buffered until the end.
+    """
+    tf = None
+    deferred = []
+    try:
+        writer.status("parsing '%s'" % path)
+        tf = tarfile.open(path, 'r|*')
+        for member in tf:
+            if not member.isfile():
+                continue
+            origin = ('tar', os.path.abspath(path), member.name)
+            if _defer_log(state, member.name, origin):
+                continue
+            file = tf.extractfile(member)
+            if member.name in _HEADER_DEPENDENT_LOGS and state.headers is None:
+                deferred.append((member.name, file.read(), origin))
+            elif pool is not None:
+                state = pool.submit(member.name, ('data', file.read()), origin)
+            else:
+                state = _do_parse(writer, state, member.name, file, origin)
+    except tarfile.ReadError as error:
+        raise ParseError("error: could not read tarfile '%s': %s." % (path, error))
+    finally:
+        if tf != None:
+            tf.close()
+    for name, data, origin in deferred:
+        if pool is not None:
+            state = pool.submit(name, ('data', data), origin)
+        else:
+            state = _do_parse(writer, state, name, io.BytesIO(data), origin)
+    return state
+
+def _parse_paths(writer, state, paths, pool):
     for path in paths:
         root, extension = os.path.splitext(path)
         if not(os.path.exists(path)):
@@ -704,24 +1467,30 @@ def parse_paths(writer, state, paths):
         if os.path.isdir(path):
             files = [ f for f in [os.path.join(path, f) for f in os.listdir(path)] if os.path.isfile(f) ]
             files.sort()
-            state = parse_paths(writer, state, files)
+            state = _parse_paths(writer, state, files, pool)
         elif extension in [".tar", ".tgz", ".gz"]:
             if extension == ".gz":
                 root, extension = os.path.splitext(root)
                 if extension != ".tar":
                     writer.warn("warning: can only handle zipped tar files, not zipped '%s'-files; ignoring" % extension)
                     continue
-            tf = None
-            try:
-                writer.status("parsing '%s'" % path)
-                tf = tarfile.open(path, 'r:*')
-                for name in tf.getnames():
-                    state = _do_parse(writer, state, name, tf.extractfile(name))
-            except tarfile.ReadError as error:
-                raise ParseError("error: could not read tarfile '%s': %s." % (path, error))
-            finally:
-                if tf != None:
-                    tf.close()
+            state = parse_tarfile(writer, state, path, pool)
         else:
-            state = parse_file(writer, state, path)
+            state = parse_file(writer, state, path, pool)
     return state
+
+def parse_paths(writer, state, paths, jobs=1):
+    """Parses the given files, directories and archives into the state.
+
+    With jobs > 1 the logs are parsed concurrently by that many worker
+    processes; their results are merged back in the order the logs
+    were found.
+    """
+    if jobs > 1 and ProcessPoolExecutor is None:
+        writer.warn("warning: concurrent.futures is not available, parsing serially.")
+    elif jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            pool = _ParsePool(writer, state, executor)
+            state = _parse_paths(writer, state, paths, pool)
+            return pool.finish()
+    return _parse_paths(writer, state, paths, None)
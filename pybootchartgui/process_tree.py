@@ -13,6 +13,9 @@
 #  You should have received a copy of the GNU General Public License
 #  along with pybootchartgui. If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from .samples import ProcessIndex, ProcessIntervals, merge_samples
+
 class ProcessTree:
     """ProcessTree encapsulates a process tree.  The tree is built from log files
        retrieved during the boot process.  When building the process tree, it is
@@ -42,6 +45,10 @@ class ProcessTree:
                  accurate_parentage, for_testing = False):
         self.writer = writer
         self.process_tree = []
+        self._layout = None
+        self._intervals = None
+        # process -> the samples it has merged in so far, see merge_processes
+        self._merged_samples = {}
         self.taskstats = taskstats
         if psstats is None:
             process_list = kernel
@@ -50,40 +57,79 @@ class ProcessTree:
         else:
             process_list = list(kernel) + list(psstats.process_map.values())
         self.process_list = sorted(process_list, key = lambda p: p.pid)
+        self.index = ProcessIndex(self.process_list)
         self.sample_period = sample_period
 
         self.build()
         if not accurate_parentage:
             self.update_ppids_for_daemons(self.process_list)
 
-        self.start_time = self.get_start_time(self.process_tree)
-        self.end_time = self.get_end_time(self.process_tree)
+        self.start_time, self.end_time = self.get_extents(self.process_tree)[:2]
         self.duration = self.end_time - self.start_time
         self.idle = idle
+        self.monitored_app = monitoredApp
+
+        # the tree as built, which the views below leave alone
+        self._pristine = (self.process_tree, self.process_list,
+                          self.start_time, self.end_time, self.duration)
+        self._views = {}
+        self.pruned = None
 
         if for_testing:
             return
 
-        removed = self.merge_logger(self.process_tree, self.LOGGER_PROC, monitoredApp, False)
-        writer.status("merged %i logger processes" % removed)
+        self.set_view(prune)
+
+    def set_view(self, prune):
+        """Switches to the tree with the logger processes merged and, if
+           prune is set, pruned and merged as described above.  Each view
+           is computed once, on copies of the processes which share their
+           samples with the tree as built, and is then kept.
+
+        """
+        view = self._views.get(prune)
+        if view is None:
+            view = self._views[prune] = self._make_view(prune)
+        self.process_tree, self.process_list, self.start_time, \
+            self.end_time, self.duration, self._layout = view
+        self._intervals = None
+        self.num_proc = len(self.layout()[0])
+        self.pruned = prune
+
+    def _make_view(self, prune):
+        process_tree, process_list, start_time, end_time, duration = self._pristine
+        copies = dict((p, p.copy(share_samples = True)) for p in process_list)
+        for p, copy in copies.items():
+            copy.parent = copies.get(p.parent)
+            copy.child_list = [copies[c] for c in p.child_list]
+        self.process_tree = [copies[p] for p in process_tree]
+        self.process_list = [copies[p] for p in process_list]
+        self.start_time, self.end_time, self.duration = start_time, end_time, duration
+
+        # a logger is merged before the loggers below it, as in a walk of the tree
+        loggers = sorted(self.index.named(self.LOGGER_PROC), key = self._depth)
+        removed = self._merge_loggers([copies[p] for p in loggers], self.monitored_app)
+        self.writer.status("merged %i logger processes" % removed)
 
         if prune:
             p_processes = self.prune(self.process_tree, None)
             p_exploders = self.merge_exploders(self.process_tree, self.EXPLODER_PROCESSES)
             p_threads = self.merge_siblings(self.process_tree)
             p_runs = self.merge_runs(self.process_tree)
-            writer.status("pruned %i process, %i exploders, %i threads, and %i runs" % (p_processes, p_exploders, p_threads, p_runs))
+            self.writer.status("pruned %i process, %i exploders, %i threads, and %i runs" % (p_processes, p_exploders, p_threads, p_runs))
 
         self.sort(self.process_tree)
 
-        self.start_time = self.get_start_time(self.process_tree)
-        self.end_time = self.get_end_time(self.process_tree)
+        self.start_time, self.end_time = self.get_extents(self.process_tree)[:2]
         self.duration = self.end_time - self.start_time
 
-        self.num_proc = self.num_nodes(self.process_tree)
+        self.layout()
+        return (self.process_tree, self.process_list, self.start_time,
+                self.end_time, self.duration, self._layout)
 
     def build(self):
         """Build the process tree from the list of top samples."""
+        self.invalidate_layout()
         self.process_tree = []
         for proc in self.process_list:
             if not proc.parent:
@@ -91,42 +137,167 @@ class ProcessTree:
             else:
                 proc.parent.child_list.append(proc)
 
+    def layout(self):
+        """Returns the rows the processes are drawn in: a list of the
+           processes in depth-first order, so that the index of a process
+           is its row, along with flat arrays of their depths in the tree
+           and of the sizes of their subtrees.  It is only computed again
+           after the tree is changed.
+
+        """
+        if self._layout is None:
+            order = []
+            depths = array('i')
+            parents = array('i')
+            # the row of the last process seen at each depth
+            last_rows = []
+            for proc, depth in self.walk(self.process_tree):
+                row = len(order)
+                order.append(proc)
+                depths.append(depth)
+                parents.append(last_rows[depth - 1] if depth else -1)
+                del last_rows[depth:]
+                last_rows.append(row)
+            sizes = array('i', [1]) * len(order)
+            for row in range(len(order) - 1, 0, -1):
+                if parents[row] >= 0:
+                    sizes[parents[row]] += sizes[row]
+            rows = dict((proc, row) for row, proc in enumerate(order))
+            self._layout = (order, depths, sizes, rows, parents)
+        return self._layout[:3]
+
+    def invalidate_layout(self):
+        """Drops the rows computed by layout(), after the tree changed."""
+        self._layout = None
+        self._intervals = None
+
+    def row_of(self, proc):
+        """Returns the row proc is drawn in."""
+        self.layout()
+        return self._layout[3][proc]
+
+    def parent_row(self, row):
+        """Returns the row of the parent in the tree of the process drawn
+           in row, or -1 for a root."""
+        self.layout()
+        return self._layout[4][row]
+
+    def lines_past(self, row):
+        """Returns the lines from the parents drawn in or above row to
+           their children below it, as (parent row, child row) pairs.
+           The parents are found by walking up from the row after it.
+
+        """
+        self.layout()
+        order, depths, sizes, rows, parents = self._layout
+        lines = []
+        child = row + 1
+        while 0 <= child < len(order) and parents[child] >= 0:
+            parent = parents[child]
+            # the subtree of a child above row runs past it, and so do
+            # the lines to the siblings after it
+            sibling = child if child > row else child + sizes[child]
+            while sibling < len(order) and parents[sibling] == parent:
+                lines.append((parent, sibling))
+                sibling += sizes[sibling]
+            child = parent
+        return lines
+
+    def subtree_size(self, proc):
+        """Returns the number of processes in the subtree rooted at proc."""
+        self.layout()
+        return self._layout[2][self._layout[3][proc]]
+
+    def intervals(self):
+        """Returns the processes of the tree by the time they were
+           running, see ProcessIntervals.  Like the layout, they are only
+           computed again after the tree is changed.
+
+        """
+        if self._intervals is None:
+            self._intervals = ProcessIntervals(self.layout()[0])
+        return self._intervals
+
+    def overlaps(self, start, end):
+        """Returns the processes running at some time from start to end."""
+        return self.intervals().overlapping(start, end)
+
+    def active_at(self, time):
+        """Returns the processes running at time."""
+        return self.intervals().running_at(time)
+
+    def state_at(self, pid, time):
+        """Returns the state process pid was sampled in last at time or
+           before, or None."""
+        proc = self.intervals().by_pid.get(pid)
+        if proc is None:
+            return None
+        return proc.samples.state_at(time)
+
+    def walk(self, process_subtree, post_order = False):
+        """Yields each process of the subtree along with its depth in it,
+           parents before their children, or after them with post_order.
+           The walk keeps its own stack, so that deep trees do not run into
+           the recursion limit.  In pre-order the children of a process
+           are only looked up once it has been handed out, so it may change
+           them, as sort() does.
+
+        """
+        stack = [(proc, 0, False) for proc in reversed(process_subtree)]
+        while stack:
+            proc, depth, done = stack.pop()
+            if done:
+                yield proc, depth
+                continue
+            if post_order:
+                stack.append((proc, depth, True))
+            else:
+                yield proc, depth
+            stack.extend((child, depth + 1, False) for child in reversed(proc.child_list))
+
     def sort(self, process_subtree):
         """Sort process tree."""
-        for p in process_subtree:
+        self.invalidate_layout()
+        for p, depth in self.walk(process_subtree):
             p.child_list.sort(key = lambda p: p.pid)
-            self.sort(p.child_list)
 
     def num_nodes(self, process_list):
         "Counts the number of nodes in the specified process tree."""
-        nodes = 0
-        for proc in process_list:
-            nodes = nodes + self.num_nodes(proc.child_list)
-        return nodes + len(process_list)
+        return sum(1 for p in self.walk(process_list))
+
+    def get_extents(self, process_subtree):
+        """Returns the start time, end time and max PID of the process
+           subtree, from a single walk: the start time of the earliest
+           process, the end time of the last collected sample and the
+           highest PID found.
+
+        """
+        start_time = 100000000
+        end_time = -100000000
+        max_pid = -100000000
+        for proc, depth in self.walk(process_subtree):
+            start_time = min(start_time, proc.start_time)
+            end_time = max(end_time, proc.start_time + proc.duration)
+            max_pid = max(max_pid, proc.pid)
+        return start_time, end_time, max_pid
 
     def get_start_time(self, process_subtree):
         """Returns the start time of the process subtree.  This is the start
            time of the earliest process.
 
         """
-        if not process_subtree:
-            return 100000000
-        return min( [min(proc.start_time, self.get_start_time(proc.child_list)) for proc in process_subtree] )
+        return self.get_extents(process_subtree)[0]
 
     def get_end_time(self, process_subtree):
         """Returns the end time of the process subtree.  This is the end time
            of the last collected sample.
 
         """
-        if not process_subtree:
-            return -100000000
-        return max( [max(proc.start_time + proc.duration, self.get_end_time(proc.child_list)) for proc in process_subtree] )
+        return self.get_extents(process_subtree)[1]
 
     def get_max_pid(self, process_subtree):
         """Returns the max PID found in the process tree."""
-        if not process_subtree:
-            return -100000000
-        return max( [max(proc.pid, self.get_max_pid(proc.child_list)) for proc in process_subtree] )
+        return self.get_extents(process_subtree)[2]
 
     def update_ppids_for_daemons(self, process_list):
         """Fedora hack: when loading the system services from rc, runuser(1)
@@ -138,11 +309,11 @@ class ProcessTree:
         rcstartpid = -1
         rcendpid = -1
         rcproc = None
-        for p in process_list:
-            if p.cmd == "rc" and p.ppid // 1000 == 1:
-                rcproc = p
-                rcstartpid = p.pid
-                rcendpid = self.get_max_pid(p.child_list)
+        rcprocs = [p for p in self.index.named("rc") if p.ppid // 1000 == 1]
+        if rcprocs:
+            rcproc = max(rcprocs, key = lambda p: p.pid)
+            rcstartpid = rcproc.pid
+            rcendpid = self.get_max_pid(rcproc.child_list)
         if rcstartpid != -1 and rcendpid != -1:
             for p in process_list:
                 if p.pid > rcstartpid and p.pid < rcendpid and p.ppid // 1000 == 1:
@@ -165,32 +336,27 @@ class ProcessTree:
                    process_end >= self.start_time + self.duration and \
                    p.start_time > self.start_time and \
                    p.duration > 0.9 * self.duration and \
-                   self.num_nodes(p.child_list) == 0
+                   len(p.child_list) == 0
 
+        self.invalidate_layout()
         num_removed = 0
-        idx = 0
-        while idx < len(process_subtree):
-            p = process_subtree[idx]
-            if parent != None or len(p.child_list) == 0:
-
-                prune = False
-                if is_idle_background_process_without_children(p):
-                    prune = True
-                elif p.duration <= 2 * self.sample_period:
-                    # short-lived process
-                    prune = True
-
-                if prune:
-                    process_subtree.pop(idx)
-                    for c in p.child_list:
-                        process_subtree.insert(idx, c)
+        lists = [(process_subtree, parent)]
+        while lists:
+            process_subtree, parent = lists.pop()
+            kept = []
+            pending = list(reversed(process_subtree))
+            while pending:
+                p = pending.pop()
+                if (parent != None or len(p.child_list) == 0) and \
+                   (is_idle_background_process_without_children(p) or
+                    p.duration <= 2 * self.sample_period): # short-lived process
+                    # the children take its place, last one first
+                    pending.extend(p.child_list)
                     num_removed += 1
-                    continue
                 else:
-                    num_removed += self.prune(p.child_list, p)
-            else:
-                num_removed += self.prune(p.child_list, p)
-            idx += 1
+                    kept.append(p)
+                    lists.append((p.child_list, p))
+            process_subtree[:] = kept
 
         return num_removed
 
@@ -199,37 +365,51 @@ class ProcessTree:
         Filter a tree depending on filter function that takes the process as
         argument.
         """
-        processes = []
-        for p in tree:
-            if filter_fn(p):
-                processes.append(p)
-            if p.child_list:
-                processes += self.filter_subtree(p.child_list, filter_fn)
-        return processes
+        return [p for p, depth in self.walk(tree) if filter_fn(p)]
 
     def merge_logger(self, process_subtree, logger_proc, monitored_app, app_tree):
         """Merges the logger's process subtree.  The logger will typically
            spawn lots of sleep and cat processes, thus polluting the
            process tree.
         """
-        num_removed = 0
         loggers = self.filter_subtree(process_subtree, lambda x: x.cmd == logger_proc)
+        return self._merge_loggers(loggers, monitored_app)
+
+    def _merge_loggers(self, loggers, monitored_app):
+        self.invalidate_layout()
+        num_removed = 0
         for p in loggers:
+            kept = []
+            # merging a child has always let the next one through unmerged
+            skip = False
             for child in p.child_list:
-                if monitored_app and child.cmd == monitored_app:
+                if skip or (monitored_app and child.cmd == monitored_app):
+                    kept.append(child)
+                    skip = False
                     continue
                 self.merge_processes(p, child)
-                p.child_list.remove(child)
                 num_removed += 1
+                skip = True
+            p.child_list[:] = kept
+        self.merge_pending_samples()
         return num_removed
 
+    def _depth(self, p):
+        depth = 0
+        while p.parent is not None:
+            p = p.parent
+            depth += 1
+        return depth
+
     def merge_exploders(self, process_subtree, processes):
         """Merges specific process subtrees (used for processes which usually
            spawn huge meaningless process trees).
 
         """
+        self.invalidate_layout()
         num_removed = 0
-        for p in process_subtree:
+        # an exploder is left without children, so the walk stops there
+        for p, depth in self.walk(process_subtree):
             if processes in processes and len(p.child_list) > 0:
                 subtreemap = self.getProcessMap(p.child_list)
                 for child in subtreemap.values():
@@ -237,8 +417,7 @@ class ProcessTree:
                     num_removed += len(subtreemap)
                     p.child_list = []
                     p.cmd += " (+)"
-            else:
-                num_removed += self.merge_exploders(p.child_list, processes)
+        self.merge_pending_samples()
         return num_removed
 
     def merge_siblings(self, process_subtree):
@@ -246,22 +425,26 @@ class ProcessTree:
            line are merged together.
 
         """
+        self.invalidate_layout()
+        num_removed = self._merge_siblings(process_subtree)
+        self.merge_pending_samples()
+        return num_removed
+
+    def _merge_siblings(self, process_subtree):
         num_removed = 0
-        idx = 0
-        while idx < len(process_subtree)-1:
-            p = process_subtree[idx]
-            nextp = process_subtree[idx+1]
-            if nextp.cmd == p.cmd:
-                process_subtree.pop(idx+1)
-                idx -= 1
-                num_removed += 1
-                p.child_list.extend(nextp.child_list)
-                self.merge_processes(p, nextp)
-            num_removed += self.merge_siblings(p.child_list)
-            idx += 1
-        if len(process_subtree) > 0:
-            p = process_subtree[-1]
-            num_removed += self.merge_siblings(p.child_list)
+        lists = [process_subtree]
+        while lists:
+            process_subtree = lists.pop()
+            kept = []
+            for p in process_subtree:
+                if kept and kept[-1].cmd == p.cmd:
+                    kept[-1].child_list.extend(p.child_list)
+                    self.merge_processes(kept[-1], p)
+                    num_removed += 1
+                else:
+                    kept.append(p)
+            process_subtree[:] = kept
+            lists.extend(p.child_list for p in reversed(kept))
         return num_removed
 
     def merge_runs(self, process_subtree):
@@ -269,35 +452,45 @@ class ProcessTree:
            command line with the parent are merged.
 
         """
+        self.invalidate_layout()
+        num_removed = self._merge_runs(process_subtree)
+        self.merge_pending_samples()
+        return num_removed
+
+    def _merge_runs(self, process_subtree):
         num_removed = 0
-        idx = 0
-        while idx < len(process_subtree):
-            p = process_subtree[idx]
-            if len(p.child_list) == 1 and p.child_list[0].cmd == p.cmd:
+        # the child lists are replaced as runs are merged, so walk them
+        # only once their parent is done
+        for p, depth in self.walk(process_subtree):
+            while len(p.child_list) == 1 and p.child_list[0].cmd == p.cmd:
                 child = p.child_list[0]
                 p.child_list = list(child.child_list)
                 self.merge_processes(p, child)
                 num_removed += 1
-                continue
-            num_removed += self.merge_runs(p.child_list)
-            idx += 1
         return num_removed
 
     def merge_processes(self, p1, p2):
-        """Merges two process' samples."""
-        p1.samples.extend(p2.samples)
-        p1.samples.sort( key = lambda p: p.time )
+        """Merges two process' samples.  The samples themselves are only
+           put together by merge_pending_samples(), all merges at once.
+        """
+        merged = self._merged_samples.get(p1)
+        if merged is None:
+            merged = self._merged_samples[p1] = [p1.samples]
+        # what p2 merged in after this is not p1's concern
+        merged.extend(self._merged_samples.get(p2, [p2.samples]))
         p1time = p1.start_time
         p2time = p2.start_time
         p1.start_time = min(p1time, p2time)
         pendtime = max(p1time + p1.duration, p2time + p2.duration)
         p1.duration = pendtime - p1.start_time
 
+    def merge_pending_samples(self):
+        """Puts together the samples of the processes merged so far."""
+        for p, merged in self._merged_samples.items():
+            p.samples = merge_samples(merged)
+        self._merged_samples = {}
+
     def _dump_tree(self, process_subtree, shift=0):
         """Get a tree printed throught the writer, helpful when debugging."""
-        idx = 0
-        while idx < len(process_subtree):
-            p = process_subtree[idx]
-            self._dump_tree(p.child_list, shift + 4)
-            idx += 1
-            self.writer.status("%s%s %d %s" % (" " * shift, p.cmd, p.pid // 1000, "(collector)" if p.cmd == self.LOGGER_PROC or (p.parent and p.parent.cmd == self.LOGGER_PROC) else ""))
+        for p, depth in self.walk(process_subtree, post_order = True):
+            self.writer.status("%s%s %d %s" % (" " * (shift + 4 * depth), p.cmd, p.pid // 1000, "(collector)" if p.cmd == self.LOGGER_PROC or (p.parent and p.parent.cmd == self.LOGGER_PROC) else ""))
@@ -13,6 +13,87 @@
 #  You should have received a copy of the GNU General Public License
 #  along with pybootchartgui. If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from itertools import count, repeat
+
+try:
+    from sys import intern
+except ImportError:
+    pass # a builtin in Python 2
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def to_column(values, integer = False):
+    """Returns values as a column: a NumPy array if NumPy is available,
+    a plain list otherwise."""
+    if numpy is not None:
+        return numpy.array(values, dtype = numpy.int64 if integer else numpy.float64)
+    return list(values)
+
+def column_list(column):
+    """Returns the values of a column as a list of Python numbers."""
+    if isinstance(column, list):
+        return column
+    return column.tolist()
+
+def column_concat(first, second):
+    if numpy is not None:
+        return numpy.concatenate((first, second))
+    return list(first) + list(second)
+
+def column_sum(*columns):
+    if numpy is not None:
+        return sum(columns[1:], columns[0])
+    return [sum(values) for values in zip(*columns)]
+
+class SampleSeries:
+    """A time series of system-wide samples, held as parallel columns
+    (see to_column) rather than one object per sample.
+
+    Indexing and iteration hand out sample objects for the code that
+    wants them; slicing returns a series.
+    """
+    fields = ('time',)
+    sample_class = None
+
+    def __init__(self, *columns):
+        for name, column in zip(self.fields, columns):
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.__class__(*[getattr(self, name)[idx] for name in self.fields])
+        values = [getattr(self, name)[idx] for name in self.fields]
+        if numpy is not None:
+            values = [value.item() for value in values]
+        return self.sample_class(*values)
+
+    def __iter__(self):
+        columns = [column_list(getattr(self, name)) for name in self.fields]
+        for values in zip(*columns):
+            yield self.sample_class(*values)
+
+    def extend(self, other):
+        """Appends the samples of other, a series of the same kind."""
+        for name in self.fields:
+            setattr(self, name, column_concat(getattr(self, name), getattr(other, name)))
+
+    def until(self, end_time):
+        """Returns the samples taken no later than end_time."""
+        if numpy is not None:
+            end = int(numpy.searchsorted(self.time, end_time, side = 'right'))
+        else:
+            end = bisect_right(self.time, end_time)
+        return self[:end]
 
 class DiskStatSample:
     def __init__(self, time):
@@ -22,6 +103,8 @@ class DiskStatSample:
         self.diskdata = [ a + b for a, b in zip(self.diskdata, new_diskdata) ]
 
 class CPUSample:
+    __slots__ = ('time', 'user', 'sys', 'io', 'swap')
+
     def __init__(self, time, user, sys, io = 0.0, swap = 0.0):
         self.time = time
         self.user = user
@@ -38,6 +121,7 @@ class CPUSample:
                str(self.sys) + "\t" + str(self.io) + "\t" + str (self.swap)
 
 class MemSample:
+    __slots__ = ('time', 'records')
     used_values = ('MemTotal', 'MemFree', 'Buffers', 'Cached', 'SwapTotal', 'SwapFree',)
 
     def __init__(self, time):
@@ -53,6 +137,8 @@ class MemSample:
         return [v for v in MemSample.used_values if v not in keys] == []
 
 class ProcessSample:
+    __slots__ = ('time', 'state', 'cpu_sample')
+
     def __init__(self, time, state, cpu_sample):
         self.time = time
         self.state = state
@@ -61,6 +147,134 @@ class ProcessSample:
     def __str__(self):
         return str(self.time) + "\t" + str(self.state) + "\t" + str(self.cpu_sample)
 
+# uninterruptible sleep, usually io
+_WAIT_STATE = ord('D')
+
+class ProcessSamples:
+    """The samples of a process, stored column-wise in typed arrays.
+
+    Indexing and iteration hand out ProcessSample views, built on
+    demand; code that walks many samples should use the columns.
+
+    Some totals are kept up to date as samples are appended: the number
+    of active samples and of samples in the D state, and the cpu (user
+    and sys), io and swap times.
+    """
+    columns = ('time', 'state', 'user', 'sys', 'io', 'swap')
+    typecodes = ('q', 'B', 'd', 'd', 'd', 'd')
+    totals = ('active_count', 'wait_count', 'cpu_total', 'io_total', 'swap_total')
+    __slots__ = columns + totals
+
+    def __init__(self):
+        for name, typecode in zip(self.columns, self.typecodes):
+            setattr(self, name, array(typecode))
+        self.active_count = 0
+        self.wait_count = 0
+        self.cpu_total = 0.0
+        self.io_total = 0.0
+        self.swap_total = 0.0
+
+    def append(self, time, state, user, sys, io = 0.0, swap = 0.0):
+        state = ord(state)
+        self.time.append(time)
+        self.state.append(state)
+        self.user.append(user)
+        self.sys.append(sys)
+        self.io.append(io)
+        self.swap.append(swap)
+        if sys + user + io > 0.0:
+            self.active_count += 1
+        if state == _WAIT_STATE:
+            self.wait_count += 1
+        self.cpu_total += user + sys
+        self.io_total += io
+        self.swap_total += swap
+
+    def extend(self, other):
+        for name in self.columns:
+            getattr(self, name).extend(getattr(other, name))
+        for name in self.totals:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def recount(self):
+        """Computes the totals over again, after the columns were changed
+        other than by appending."""
+        self.active_count = sum(1 for sys, user, io in zip(self.sys, self.user, self.io) if sys + user + io > 0.0)
+        self.wait_count = self.state.count(_WAIT_STATE)
+        self.cpu_total = sum(user + sys for user, sys in zip(self.user, self.sys))
+        self.io_total = sum(self.io)
+        self.swap_total = sum(self.swap)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, idx):
+        return ProcessSample(self.time[idx], chr(self.state[idx]),
+                             CPUSample('null', self.user[idx], self.sys[idx],
+                                       self.io[idx], self.swap[idx]))
+
+    def __iter__(self):
+        for time, state, user, sys, io, swap in zip(self.time, self.state, self.user,
+                                                    self.sys, self.io, self.swap):
+            yield ProcessSample(time, chr(state), CPUSample('null', user, sys, io, swap))
+
+    def is_sorted(self):
+        time = self.time
+        return all(time[i] <= time[i + 1] for i in range(len(time) - 1))
+
+    def sort(self):
+        """Orders the samples by time; samples with equal times keep
+        their relative order."""
+        time = self.time
+        if self.is_sorted():
+            return
+        order = sorted(range(len(time)), key = time.__getitem__)
+        for name in self.columns:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[i] for i in order]))
+
+    def state_at(self, time):
+        """Returns the state of the process in the last sample taken at
+        time or before it, or None."""
+        idx = bisect_right(self.time, time)
+        if idx == 0:
+            return None
+        return chr(self.state[idx - 1])
+
+    def truncate(self, end_time):
+        """Drops the samples taken after end_time."""
+        end = bisect_right(self.time, end_time)
+        for name in self.columns:
+            del getattr(self, name)[end:]
+        self.recount()
+
+    def drop_before(self, start_time):
+        """Drops the samples taken before start_time."""
+        start = bisect_left(self.time, start_time)
+        for name in self.columns:
+            del getattr(self, name)[:start]
+        self.recount()
+
+def merge_samples(runs):
+    """Returns the ProcessSamples in runs merged into one, in the order
+    sorting their concatenation by time would give."""
+    sorted_runs = []
+    for run in runs:
+        if not run.is_sorted():
+            copy = ProcessSamples()
+            copy.extend(run)
+            copy.sort()
+            run = copy
+        sorted_runs.append(run)
+    # ties are broken by run, then by position in the run
+    order = list(merge(*[zip(run.time, repeat(idx), count()) for idx, run in enumerate(sorted_runs)]))
+    merged = ProcessSamples()
+    for name, typecode in zip(merged.columns, merged.typecodes):
+        columns = [getattr(run, name) for run in sorted_runs]
+        setattr(merged, name, array(typecode, [columns[idx][pos] for time, idx, pos in order]))
+    merged.recount()
+    return merged
+
 class ProcessStats:
     def __init__(self, writer, process_map, sample_count, sample_period, start_time, end_time):
         self.process_map = process_map
@@ -72,16 +286,21 @@ class ProcessStats:
         writer.info ("process list size: %d" % len (self.process_map.values()))
 
 class Process:
+    __slots__ = ('writer', 'pid', 'cmd', 'exe', 'args', 'ppid', 'start_time', 'duration',
+                 'samples', 'parent', 'child_list', 'active',
+                 'last_user_cpu_time', 'last_sys_cpu_time',
+                 'last_cpu_ns', 'last_blkio_delay_ns', 'last_swapin_delay_ns')
+
     def __init__(self, writer, pid, cmd, ppid, start_time):
         self.writer = writer
         self.pid = pid
-        self.cmd = cmd
-        self.exe = cmd
+        self.cmd = intern(cmd)
+        self.exe = self.cmd
         self.args = []
         self.ppid = ppid
         self.start_time = start_time
         self.duration = 0
-        self.samples = []
+        self.samples = ProcessSamples()
         self.parent = None
         self.child_list = []
 
@@ -103,18 +322,32 @@ class Process:
 
         return split
 
+    def copy(self, share_samples = False):
+        """Returns a copy of the process, without its parent and children.
+        With share_samples, the copy refers to the samples of the process
+        rather than to a copy of them; they must not be changed in place."""
+        copy = Process (self.writer, self.pid, self.cmd, self.ppid, self.start_time)
+        copy.exe = self.exe
+        copy.args = self.args
+        copy.duration = self.duration
+        copy.active = self.active
+        if share_samples:
+            copy.samples = self.samples
+        else:
+            copy.samples.extend(self.samples)
+        return copy
+
     def __str__(self):
         return " ".join([str(self.pid), self.cmd, str(self.ppid), '[ ' + str(len(self.samples)) + ' samples ]' ])
 
     def calc_stats(self, samplePeriod):
-        if self.samples:
-            firstSample = self.samples[0]
-            lastSample = self.samples[-1]
-            self.start_time = min(firstSample.time, self.start_time)
-            self.duration = lastSample.time - self.start_time + samplePeriod
-
-        activeCount = sum( [1 for sample in self.samples if sample.cpu_sample and sample.cpu_sample.sys + sample.cpu_sample.user + sample.cpu_sample.io > 0.0] )
-        activeCount = activeCount + sum( [1 for sample in self.samples if sample.state == 'D'] )
+        samples = self.samples
+        if samples:
+            self.start_time = min(samples.time[0], self.start_time)
+            self.duration = samples.time[-1] - self.start_time + samplePeriod
+
+        # counted as the samples were taken
+        activeCount = samples.active_count + samples.wait_count
         self.active = (activeCount>2)
 
     def calc_load(self, userCpu, sysCpu, interval):
@@ -138,7 +371,111 @@ class Process:
     def get_end_time(self):
         return self.start_time + self.duration
 
+class ProcessIndex:
+    """The processes by command name, and by executable, in the order
+    they were started."""
+    def __init__(self, processes):
+        self._processes = sorted(processes, key = lambda p: p.start_time)
+        self._by_cmd = self._by(lambda p: p.cmd)
+        # the executables may only be known once the command lines are loaded
+        self._by_exe = None
+
+    def _by(self, key):
+        index = {}
+        for proc in self._processes:
+            index.setdefault(key(proc), []).append(proc)
+        return index
+
+    def named(self, name):
+        """Returns the processes with the command name."""
+        return self._by_cmd.get(name, [])
+
+    def first(self, names, exe = False):
+        """Returns the first process started with one of the command names
+        or, if exe is set, one of the executables, or None."""
+        found = [self._by_cmd.get(name, [None])[0] for name in names]
+        if exe:
+            if self._by_exe is None:
+                self._by_exe = self._by(lambda p: p.exe)
+            found += [self._by_exe.get(name, [None])[0] for name in names]
+        found = [proc for proc in found if proc is not None]
+        if not found:
+            return None
+        return min(found, key = lambda p: p.start_time)
+
+class ProcessIntervals:
+    """The processes by the time they were running, from their start to
+    their end, both included: the processes running over a stretch of
+    time are found without going through the others.
+
+    Those started in the stretch are found among the processes sorted by
+    start time.  Those already running at its start are found in a
+    centered interval tree: each node keeps the processes running at its
+    center, sorted by start and by end time, and has the processes which
+    ended before the center on its left and those started after it on
+    its right.
+    """
+    def __init__(self, processes):
+        self.by_pid = {}
+        intervals = []
+        for proc in processes:
+            self.by_pid[proc.pid] = proc
+            intervals.append((proc.start_time, proc.start_time + proc.duration, proc))
+        intervals.sort(key = lambda i: i[0])
+        self._starts = [start for start, end, proc in intervals]
+        self._by_start = [proc for start, end, proc in intervals]
+
+        self._root = None
+        stack = [(intervals, None, 0)] if intervals else []
+        while stack:
+            intervals, parent, side = stack.pop()
+            points = sorted([i[0] for i in intervals] + [i[1] for i in intervals])
+            center = points[len(points) // 2]
+            left = [i for i in intervals if i[1] < center]
+            right = [i for i in intervals if i[0] > center]
+            here = [i for i in intervals if i[0] <= center <= i[1]]
+            # sorted by start time already
+            by_end = sorted(here, key = lambda i: i[1])
+            node = [center,
+                    [i[0] for i in here], [i[2] for i in here],
+                    [i[1] for i in by_end], [i[2] for i in by_end],
+                    None, None]
+            if parent is None:
+                self._root = node
+            else:
+                parent[side] = node
+            if left:
+                stack.append((left, node, 5))
+            if right:
+                stack.append((right, node, 6))
+
+    def running_at(self, time):
+        """Returns the processes running at time."""
+        found = []
+        node = self._root
+        while node is not None:
+            center, starts, by_start, ends, by_end, left, right = node
+            if time < center:
+                found.extend(by_start[:bisect_right(starts, time)])
+                node = left
+            elif time > center:
+                found.extend(by_end[bisect_left(ends, time):])
+                node = right
+            else:
+                found.extend(by_start)
+                break
+        return found
+
+    def overlapping(self, start, end):
+        """Returns the processes running at some time from start to end."""
+        found = self.running_at(start)
+        found.extend(self._by_start[bisect_right(self._starts, start):
+                                    bisect_right(self._starts, end)])
+        return found
+
 class DiskSample:
+    __slots__ = ('time', 'read', 'write', 'util', 'tput')
+
     def __init__(self, time, read, write, util):
         self.time = time
         self.read = read
@@ -148,3 +485,25 @@ class DiskSample:
 
     def __str__(self):
         return "\t".join([str(self.time), str(self.read), str(self.write), str(self.util)])
+
+class CPUStats(SampleSeries):
+    """System-wide CPU utilisation, as fractions of the sample interval."""
+    fields = ('time', 'user', 'sys', 'io')
+    sample_class = CPUSample
+
+    @property
+    def cpu(self):
+        return column_sum(self.user, self.sys)
+
+    @property
+    def cpu_io(self):
+        return column_sum(self.user, self.sys, self.io)
+
+class DiskStats(SampleSeries):
+    """Disk throughput (sectors/s) and utilisation."""
+    fields = ('time', 'read', 'write', 'util')
+    sample_class = DiskSample
+
+    @property
+    def tput(self):
+        return column_sum(self.read, self.write)
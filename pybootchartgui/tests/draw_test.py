@@ -0,0 +1,303 @@
+import sys, os, math, random, gc, weakref, shutil, tempfile
+from collections import Counter
+import unittest
+
+sys.path.insert(0, os.getcwd())
+
+import pybootchartgui.parsing as parsing
+import pybootchartgui.draw as draw
+import pybootchartgui.main as main
+from pybootchartgui.samples import CPUStats, Process
+
+bootchart_dir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
+parser = main._mk_options_parser()
+options, args = parser.parse_args(['--q', '--no-cache', bootchart_dir])
+writer = main._mk_writer(options)
+
+# parts of examples/1 in the process chart, as (x, y, w, h)
+CLIPS = [(0, 700, 1535, 33), (300, 600, 400, 250), (850, 1200, 300, 100), (123, 450, 77, 900)]
+
+class MockContext:
+	"""Stands in for a cairo context, keeping each fill as its color and
+	path and each stroke as its color, dashes and path.  A path is a list
+	of ('rect', x, y, w, h), ('line', points) and ('arc',) parts.  The
+	fills, strokes and texts are also kept in order, by kind and color."""
+
+	def __init__(self, clip):
+		self.clip = clip
+		self.color = None
+		self.dash = ()
+		self.path = []
+		self.fills = []
+		self.strokes = []
+		self.texts = []
+		self.order = []
+
+	def __getattr__(self, name):
+		# fonts, line widths and caps
+		return lambda *args: None
+
+	def clip_extents(self):
+		return self.clip
+
+	def user_to_device_distance(self, dx, dy):
+		return dx, dy
+
+	def text_extents(self, text):
+		return (0, -10, 6 * len(text), 10, 6 * len(text), 0)
+
+	def font_extents(self):
+		return (10, 3, 13, 13, 0)
+
+	def set_source_rgba(self, *color):
+		self.color = color
+
+	def set_dash(self, dash, offset = 0):
+		self.dash = tuple(dash)
+
+	def move_to(self, x, y):
+		self.path.append(('line', [(x, y)]))
+
+	def line_to(self, x, y):
+		self.path[-1][1].append((x, y))
+
+	def rectangle(self, x, y, w, h):
+		self.path.append(('rect', x, y, w, h))
+
+	def arc(self, *args):
+		self.path.append(('arc',))
+
+	def fill(self):
+		self.fills.append((self.color, self.path))
+		self.order.append(('fill', self.color))
+		self.path = []
+
+	def stroke_preserve(self):
+		self.strokes.append((self.color, self.dash, list(self.path)))
+		self.order.append(('stroke', self.color))
+
+	def stroke(self):
+		self.stroke_preserve()
+		self.path = []
+
+	def show_text(self, text):
+		self.texts.append(text)
+		self.order.append(('text', self.color))
+
+def render(clip = (0, 0, 100000, 100000), xscale = 1.0, trace = None):
+	if trace is None:
+		trace = parsing.Trace(writer, args, options)
+	ctx = MockContext(clip)
+	draw.render(ctx, draw.RenderOptions(options), xscale, trace)
+	return ctx
+
+def clip_segment(p, q, clip):
+	"""Returns the part of the segment from p to q in clip, as the
+	fractions of it where it starts and ends, or None."""
+	x, y, w, h = clip
+	t0, t1 = 0.0, 1.0
+	dx, dy = q[0] - p[0], q[1] - p[1]
+	for d, low, high, v in ((dx, x, x + w, p[0]), (dy, y, y + h, p[1])):
+		if d == 0:
+			if v < low or v > high:
+				return None
+			continue
+		a, b = (low - v) / float(d), (high - v) / float(d)
+		t0, t1 = max(t0, min(a, b)), min(t1, max(a, b))
+	if t1 <= t0:
+		return None
+	return t0, t1
+
+def stroked(ctx, clip):
+	"""Returns the set of the pieces of the strokes of ctx in clip, each
+	with where it falls in the pattern of its dashes."""
+	pieces = set()
+	for color, dash, path in ctx.strokes:
+		period = sum(dash)
+		for part in path:
+			if part[0] == 'rect':
+				x, y, w, h = part[1:]
+				points = [(x, y), (x + w, y), (x + w, y + h), (x, y + h), (x, y)]
+			elif part[0] == 'line':
+				points = part[1]
+			else:
+				continue
+			distance = 0.0
+			for p, q in zip(points, points[1:]):
+				length = math.hypot(q[0] - p[0], q[1] - p[1])
+				inside = clip_segment(p, q, clip)
+				if inside is not None:
+					t0, t1 = inside
+					ends = tuple(round(v, 3) for t in (t0, t1)
+						     for v in (p[0] + t * (q[0] - p[0]), p[1] + t * (q[1] - p[1])))
+					phase = None
+					if period:
+						phase = round((distance + t0 * length) % period, 3) % period
+					pieces.add((color, dash, ends, phase))
+				distance += length
+	return pieces
+
+def filled(ctx, clip):
+	"""Returns how many fills of each color cover each pixel of clip,
+	counting only the fills of rectangles."""
+	covered = Counter()
+	cx, cy, cw, ch = clip
+	for color, path in ctx.fills:
+		if any(part[0] != 'rect' for part in path):
+			continue
+		cells = set()
+		for part in path:
+			x, y, w, h = part[1:]
+			# the pixels whose centers are in both the rectangle and clip
+			xs = range(int(math.ceil(max(x, cx) - 0.5)), int(math.ceil(min(x + w, cx + cw) - 0.5)))
+			ys = range(int(math.ceil(max(y, cy) - 0.5)), int(math.ceil(min(y + h, cy + ch) - 0.5)))
+			cells.update((i, j) for i in xs for j in ys)
+		covered.update((color, i, j) for i, j in cells)
+	return covered
+
+class ProcTree:
+	"""The parts of a process tree the activity of a process is drawn
+	with."""
+	def __init__(self, duration, sample_period):
+		self.start_time = 0
+		self.duration = duration
+		self.sample_period = sample_period
+
+def activity(proc, proc_tree, rect, clip = (0, 0, 100000, 100000)):
+	ctx = MockContext(clip)
+	batch = draw.RenderBatch()
+	draw.draw_process_activity_colors(batch, proc, proc_tree, rect[0], rect[1], rect[2], rect[3], rect, clip)
+	batch.flush(ctx)
+	return ctx
+
+def running(alpha):
+	alpha = round(alpha * draw.ALPHA_STEPS) / float(draw.ALPHA_STEPS)
+	return draw.PROC_COLOR_R[0:3] + (alpha,)
+
+class TestDraw(unittest.TestCase):
+
+	def testClippedStrokes(self):
+		trace = parsing.Trace(writer, args, options)
+		for xscale in (1.0, 0.2):
+			full = render(xscale = xscale, trace = trace)
+			for clip in CLIPS:
+				self.assertEqual(stroked(full, clip), stroked(render(clip, xscale, trace), clip))
+
+	def testClippedFills(self):
+		trace = parsing.Trace(writer, args, options)
+		mem_dir = tempfile.mkdtemp()
+		try:
+			for name in ['header', 'proc_diskstats.log', 'proc_ps.log', 'proc_stat.log']:
+				shutil.copy(os.path.join(bootchart_dir, name), mem_dir)
+			# with a memory chart above the processes, out of the clips
+			with open(os.path.join(mem_dir, 'proc_meminfo.log'), 'w') as f:
+				for i, time in enumerate(trace.cpu_stats.time):
+					f.write("%d\nMemTotal: 1000000 kB\nMemFree: %d kB\nBuffers: 500 kB\nCached: 6000 kB\n"
+						"SwapTotal: 5000 kB\nSwapFree: 4000 kB\n\n" % (time, 500000 + i % 7 * 1000))
+			mem_trace = parsing.Trace(writer, [mem_dir], options)
+		finally:
+			shutil.rmtree(mem_dir)
+		self.assertIn("Used", render(trace = mem_trace).texts)
+		for trace in (trace, mem_trace):
+			for xscale in (1.0, 0.2):
+				full = render(xscale = xscale, trace = trace)
+				for clip in CLIPS:
+					self.assertEqual(filled(full, clip), filled(render(clip, xscale, trace), clip))
+
+	def testDecimateKeepsExtremes(self):
+		rand = random.Random(7)
+		times = sorted(rand.randint(0, 5000) for i in range(3000))
+		values = [rand.random() for t in times]
+		columns = [(t * 0.3 + 10) * 2 for t in times]
+		kinds = [(times, values)]
+		if draw.numpy is not None:
+			kinds.append((draw.numpy.array(times), draw.numpy.array(values)))
+		for ts, vs in kinds:
+			picked = [int(i) for i in draw._decimate(ts, vs, 0, 0.3, 10, 2)]
+			self.assertEqual(sorted(set(picked)), picked)
+			self.assertEqual(0, picked[0])
+			self.assertEqual(len(times) - 1, picked[-1])
+			by_column = {}
+			for i, column in enumerate(columns):
+				by_column.setdefault(math.floor(column), []).append(values[i])
+			kept = {}
+			for i in picked:
+				kept.setdefault(math.floor(columns[i]), []).append(values[i])
+			self.assertEqual(sorted(by_column.keys()), sorted(kept.keys()))
+			for column, column_values in by_column.items():
+				self.assertIn(min(column_values), kept[column])
+				self.assertIn(max(column_values), kept[column])
+				self.assertTrue(len(kept[column]) <= 4)
+
+	def testDecimatedDropped(self):
+		times = list(range(1000))
+		stats = CPUStats(times, [0.5] * 1000, [0.0] * 1000, [0.0] * 1000)
+		ctx = MockContext((0, 0, 100, 100))
+		picked = draw._decimated_samples(ctx, (stats, 'cpu'), stats.time, stats.user, (0, 0, 100, 50), 0, 0.1)
+		self.assertTrue(len(picked[0]) < len(times))
+		self.assertIn(stats, draw._decimated)
+		# the series is not kept alive for the sake of the chart
+		owner = weakref.ref(stats)
+		del stats
+		gc.collect()
+		self.assertEqual(None, owner())
+
+	def testActivitySpans(self):
+		proc = Process(writer, 1000, 'p', 0, 0)
+		for time, state, user in [(0, 'R', 1.0), (10, 'R', 1.0), (20, 'R', 1.0), (30, 'S', 0.0),
+					  (40, 'D', 0.0), (50, 'D', 0.0), (60, 'R', 0.5), (70, 'R', 1.0)]:
+			proc.samples.append(time, state, user, 0.0)
+		rect = (0, 0, 100, 16)
+		ctx = activity(proc, ProcTree(100, 10), rect)
+		# one fill for each color, of the samples next to each other at once
+		self.assertEqual(4, len(ctx.fills))
+		self.assertEqual([1, 2, 1, 1], [len(path) for color, path in ctx.fills])
+		expected = Counter()
+		for color, start, end in [(draw.PROC_COLOR_S, 0, 100), (running(1.0), 0, 30), (draw.PROC_COLOR_D, 40, 60),
+					  (running(0.5), 60, 70), (running(1.0), 70, 80)]:
+			expected.update((color, i, j) for i in range(start, end) for j in range(16))
+		self.assertEqual(expected, filled(ctx, rect))
+
+	def testActivityWithinPixels(self):
+		proc = Process(writer, 1000, 'p', 0, 0)
+		for time in range(1000):
+			proc.samples.append(time, 'R', (time * 7 % 11) / 20.0, 0.0)
+		rect = (0, 0, 100, 16)
+		ctx = activity(proc, ProcTree(1000, 1), rect)
+		# of the samples within a pixel, the one with the highest alpha
+		alphas = {}
+		for time in range(1000):
+			tx = round(time * 100 / 1000.0)
+			alphas[tx] = max(alphas.get(tx, 0), round((time * 7 % 11) / 20.0 * draw.ALPHA_STEPS))
+		expected = Counter((draw.PROC_COLOR_S, i, j) for i in range(100) for j in range(16))
+		expected.update((running(alpha / float(draw.ALPHA_STEPS)), i, j)
+				for i, alpha in alphas.items() for j in range(16))
+		self.assertEqual(expected, filled(ctx, (0, 0, 101, 16)))
+		self.assertEqual(1 + len(set(alphas.values())), len(ctx.fills))
+		self.assertTrue(sum(len(path) for color, path in ctx.fills) < 101)
+
+	def testLegend(self):
+		ctx = MockContext((0, 0, 1000, 100))
+		batch = draw.RenderBatch()
+		draw.draw_legend_box(batch, "CPU (user+sys)", draw.CPU_COLOR, 10, 20, 10)
+		draw.draw_legend_box(batch, "I/O (wait)", draw.IO_COLOR, 130, 20, 10)
+		draw.draw_legend_line(batch, "Disk throughput", draw.DISK_TPUT_COLOR, 250, 20, 10)
+		draw.draw_legend_box(batch, "Disk utilization", draw.IO_COLOR, 370, 20, 10)
+		batch.flush(ctx)
+		# the boxes and lines are filled first, a color at once, then
+		# the borders, dots and labels are drawn in the order they came
+		self.assertEqual([('fill', draw.CPU_COLOR), ('fill', draw.IO_COLOR), ('fill', draw.DISK_TPUT_COLOR),
+				  ('stroke', draw.PROC_BORDER_COLOR), ('text', draw.TEXT_COLOR),
+				  ('stroke', draw.PROC_BORDER_COLOR), ('text', draw.TEXT_COLOR),
+				  ('fill', draw.DISK_TPUT_COLOR), ('text', draw.TEXT_COLOR),
+				  ('stroke', draw.PROC_BORDER_COLOR), ('text', draw.TEXT_COLOR)], ctx.order)
+		self.assertEqual([('rect', 10, 10, 10, 10)], ctx.fills[0][1])
+		self.assertEqual([('rect', 130, 10, 10, 10), ('rect', 370, 10, 10, 10)], ctx.fills[1][1])
+		self.assertEqual([('rect', 250, 15, 11, 3)], ctx.fills[2][1])
+		self.assertEqual(["CPU (user+sys)", "I/O (wait)", "Disk throughput", "Disk utilization"], ctx.texts)
+		# nothing is left for the next flush
+		batch.flush(ctx)
+		self.assertEqual(11, len(ctx.order))
+
+if __name__ == '__main__':
+	unittest.main()
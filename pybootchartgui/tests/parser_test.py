@@ -1,11 +1,14 @@
-import sys, os, re, struct, operator, math
+import sys, os, re, struct, operator, math, shutil, tempfile, array, tarfile
 from collections import defaultdict
 import unittest
 
 sys.path.insert(0, os.getcwd())
 
 import pybootchartgui.parsing as parsing
+import pybootchartgui.cache as cache
+import pybootchartgui.samples as samples
 import pybootchartgui.main as main
+from pybootchartgui.samples import ProcessSamples, column_list
 
 debug = False
 
@@ -14,7 +17,7 @@ def floatEq(f1, f2):
 
 bootchart_dir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
 parser = main._mk_options_parser()
-options, args = parser.parse_args(['--q', bootchart_dir])
+options, args = parser.parse_args(['--q', '--no-cache', bootchart_dir])
 writer = main._mk_writer(options)
 
 class TestBCParser(unittest.TestCase):
@@ -100,6 +103,283 @@ class TestBCParser(unittest.TestCase):
 			self.assertTrue(floatEq(float(tokens[3]), sample.io))
 		stat_data.close()
 
+	def testLazyLogs(self):
+		boottime_options, boottime_args = parser.parse_args(['--q', '--no-cache', '-t', bootchart_dir])
+		trace = parsing.Trace(writer, boottime_args, boottime_options)
+		self.assertTrue('proc_stat.log' in trace._pending_logs)
+		self.assertEqual(141, len(trace.cpu_stats))
+		self.assertFalse('proc_stat.log' in trace._pending_logs)
+
+	def testTimeWindow(self):
+		window_options, window_args = parser.parse_args(['--q', '--no-cache', '--from=10', '--to=20', bootchart_dir])
+		trace = parsing.Trace(writer, window_args, window_options)
+		full = parsing.Trace(writer, args, options)
+		expected = [(s.time, s.user, s.sys, s.io) for s in full.cpu_stats if 1000 <= s.time <= 2000]
+		self.assertEqual(expected, [(s.time, s.user, s.sys, s.io) for s in trace.cpu_stats])
+		for proc in trace.ps_stats.process_map.values():
+			self.assertTrue(all(1000 <= s.time <= 2000 for s in proc.samples))
+			# the bars start with the window
+			self.assertTrue(proc.start_time >= 1000)
+		self.assertTrue(trace.proc_tree.start_time >= 1000)
+
+	def testEmptyTimeWindow(self):
+		for window in [(99999, None), (None, 0.1), (20, 10)]:
+			self.assertRaises(parsing.ParseError, parsing.Trace, writer, args, options, window)
+		self.assertEqual(2, main.main(['--q', '--no-cache', '--from=20', '--to=10', bootchart_dir]))
+
+	def testParsePacct(self):
+		trace = parsing.Trace(writer, args, options)
+		pacct = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/2/kernel_pacct')
+		parent_map = parsing.parse_file(writer, trace, pacct).parent_map
+		self.assertEqual(5023, len(parent_map))
+		self.assertEqual(0, parent_map[0])
+		self.assertEqual(512, parent_map[520])
+		self.assertEqual(515, parent_map[523])
+
+	def testLiveTrace(self):
+		live_dir = tempfile.mkdtemp()
+		try:
+			logs = ['header', 'proc_diskstats.log', 'proc_ps.log', 'proc_stat.log']
+			for name in logs:
+				shutil.copy(self.mk_fname(name), live_dir)
+			# cut the process log in the middle of a block
+			ps_log = os.path.join(live_dir, 'proc_ps.log')
+			with open(ps_log, 'rb') as f:
+				data = f.read()
+			with open(ps_log, 'wb') as f:
+				f.write(data[:len(data) // 2])
+			live = parsing.LiveTrace(writer, live_dir, options)
+			self.assertFalse(live.poll())
+			with open(ps_log, 'ab') as f:
+				f.write(data[len(data) // 2:])
+			self.assertTrue(live.poll())
+
+			full = parsing.Trace(writer, args, options)
+			self.assertEqual(full.ps_stats.sample_count, live.ps_stats.sample_count)
+			self.assertEqual(sorted(full.ps_stats.process_map.keys()), sorted(live.ps_stats.process_map.keys()))
+			self.assertEqual(full.proc_tree.num_proc, live.proc_tree.num_proc)
+		finally:
+			shutil.rmtree(live_dir)
+
+	def testLazyCmdline(self):
+		cmdline_dir = tempfile.mkdtemp()
+		try:
+			for name in ['header', 'proc_diskstats.log', 'proc_ps.log', 'proc_stat.log']:
+				shutil.copy(self.mk_fname(name), cmdline_dir)
+			with open(os.path.join(cmdline_dir, 'cmdline2.log'), 'wb') as f:
+				f.write(b'1183\n:/sbin/udevd\n:udevd\0--daemon\0\n\n')
+			options, args = parser.parse_args(['--q', '--no-cache', cmdline_dir])
+			trace = parsing.Trace(writer, args, options)
+			self.assertEqual(None, trace.proc_index.first(['/sbin/udevd'], exe = True))
+			self.assertEqual(['udevd', '--daemon'], trace.cmdline[1183]['args'])
+			proc = trace.proc_index.first(['/sbin/udevd'], exe = True)
+			self.assertEqual(1183, proc.pid // 1000)
+		finally:
+			shutil.rmtree(cmdline_dir)
+
+	def cached_trace(self, cache_dir, path):
+		cache_options, cache_args = parser.parse_args(['--q', '--cache-dir=' + cache_dir, path])
+		return parsing.Trace(writer, cache_args, cache_options)
+
+	def assertSameTrace(self, expected, trace):
+		def columns(series):
+			if series is None:
+				return None
+			return [column_list(getattr(series, name)) for name in series.fields]
+		self.assertEqual(columns(expected.cpu_stats), columns(trace.cpu_stats))
+		self.assertEqual(columns(expected.disk_stats), columns(trace.disk_stats))
+		self.assertEqual(expected.parent_map, trace.parent_map)
+		self.assertEqual(sorted(expected.ps_stats.process_map.keys()), sorted(trace.ps_stats.process_map.keys()))
+		for key, proc in expected.ps_stats.process_map.items():
+			cached = trace.ps_stats.process_map[key]
+			self.assertEqual((proc.pid, proc.cmd, proc.ppid, proc.start_time, proc.duration),
+					 (cached.pid, cached.cmd, cached.ppid, cached.start_time, cached.duration))
+			for name in ProcessSamples.columns:
+				self.assertEqual(list(getattr(proc.samples, name)), list(getattr(cached.samples, name)))
+		self.assertEqual(expected.proc_tree.num_proc, trace.proc_tree.num_proc)
+
+	def testTarfileHeaderLast(self):
+		tar_dir = tempfile.mkdtemp()
+		try:
+			# the disk stats need the header, which only comes at the end
+			path = os.path.join(tar_dir, 'bootchart.tgz')
+			with tarfile.open(path, 'w:gz') as tf:
+				for name in ['proc_diskstats.log', 'proc_ps.log', 'proc_stat.log', 'header']:
+					tf.add(self.mk_fname(name), name)
+			trace = parsing.Trace(writer, [path], options)
+			expected = parsing.Trace(writer, args, options)
+			self.assertEqual(expected.headers, trace.headers)
+			self.assertSameTrace(expected, trace)
+		finally:
+			shutil.rmtree(tar_dir)
+
+	def testJobs(self):
+		examples = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/')
+		for path in (bootchart_dir, os.path.join(examples, '2'), os.path.join(examples, '3/f11_bootchart.tgz')):
+			serial_options, serial_args = parser.parse_args(['--q', '--no-cache', '-j', '1', path])
+			jobs_options, jobs_args = parser.parse_args(['--q', '--no-cache', '-j', '4', path])
+			expected = parsing.Trace(writer, serial_args, serial_options)
+			trace = parsing.Trace(writer, jobs_args, jobs_options)
+			self.assertEqual(expected.headers, trace.headers)
+			self.assertSameTrace(expected, trace)
+
+	def testWithoutNumpy(self):
+		pacct_dir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/2/')
+		def parse(path):
+			with open(os.path.join(path, 'proc_stat.log'), 'rb') as f:
+				cpu_stats = parsing._parse_proc_stat_log(f)
+			with open(os.path.join(path, 'proc_diskstats.log'), 'rb') as f:
+				disk_stats = parsing._parse_proc_disk_stat_log(f, 2)
+			return [[column_list(getattr(series, name)) for name in series.fields]
+				for series in (cpu_stats, disk_stats)]
+		for path in (bootchart_dir, pacct_dir):
+			expected = parse(path)
+			# the columns are built from lists when NumPy is missing
+			numpy = parsing.numpy
+			parsing.numpy = samples.numpy = None
+			try:
+				self.assertEqual(expected, parse(path))
+			finally:
+				parsing.numpy = samples.numpy = numpy
+
+	def testCacheRoundTrip(self):
+		cache_dir = tempfile.mkdtemp()
+		try:
+			pacct_dir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/2/')
+			for path in (bootchart_dir, pacct_dir):
+				self.cached_trace(cache_dir, path)
+				fresh = parsing.Trace(writer, [path], options)
+				self.assertTrue(cache.TraceCache(writer, cache_dir).load(parsing.Trace(writer, [path], options), [path]))
+				self.assertSameTrace(fresh, self.cached_trace(cache_dir, path))
+			self.assertEqual(2, len([name for name in os.listdir(cache_dir) if name.endswith(cache.SUFFIX)]))
+		finally:
+			shutil.rmtree(cache_dir)
+
+	def testCacheMiss(self):
+		cache_dir = tempfile.mkdtemp()
+		trace_dir = tempfile.mkdtemp()
+		try:
+			for name in ['header', 'proc_diskstats.log', 'proc_ps.log', 'proc_stat.log']:
+				shutil.copy(self.mk_fname(name), trace_dir)
+			trace_cache = cache.TraceCache(writer, cache_dir)
+			self.cached_trace(cache_dir, trace_dir)
+			self.assertTrue(trace_cache.load(parsing.Trace(writer, [trace_dir], options), [trace_dir]))
+			# a newer log of the same size
+			stat_log = os.path.join(trace_dir, 'proc_stat.log')
+			st = os.stat(stat_log)
+			os.utime(stat_log, (st.st_atime, st.st_mtime + 10))
+			self.assertFalse(trace_cache.load(parsing.Trace(writer, [trace_dir], options), [trace_dir]))
+			self.cached_trace(cache_dir, trace_dir)
+			self.assertTrue(trace_cache.load(parsing.Trace(writer, [trace_dir], options), [trace_dir]))
+			# a longer log with the same time
+			st = os.stat(stat_log)
+			with open(stat_log, 'ab') as f:
+				f.write(b'\n')
+			os.utime(stat_log, (st.st_atime, st.st_mtime))
+			self.assertFalse(trace_cache.load(parsing.Trace(writer, [trace_dir], options), [trace_dir]))
+		finally:
+			shutil.rmtree(cache_dir)
+			shutil.rmtree(trace_dir)
+
+	def testCacheKey(self):
+		key = cache.cache_key([bootchart_dir], ['proc_stat.log'], (0, 1000))
+		self.assertEqual(key, cache.cache_key([bootchart_dir], ['proc_stat.log'], (0, 1000)))
+		self.assertNotEqual(key, cache.cache_key([bootchart_dir], [], (0, 1000)))
+		self.assertNotEqual(key, cache.cache_key([bootchart_dir], ['proc_stat.log'], None))
+		version = cache.FORMAT_VERSION
+		cache.FORMAT_VERSION = version + 1
+		try:
+			self.assertNotEqual(key, cache.cache_key([bootchart_dir], ['proc_stat.log'], (0, 1000)))
+		finally:
+			cache.FORMAT_VERSION = version
+
+	def testCacheEviction(self):
+		cache_dir = tempfile.mkdtemp()
+		try:
+			times = array.array('q', [0, 1, 2, 3])
+			offsets = array.array('q', [0, 10, 20, 30, 40])
+			origins = [('path', self.mk_fname(name)) for name in ['header', 'proc_ps.log', 'proc_stat.log']]
+			entries = [os.path.join(cache_dir, cache.index_key(origin) + cache.INDEX_SUFFIX) for origin in origins]
+			trace_cache = cache.TraceCache(writer, cache_dir)
+			trace_cache.store_index(origins[0], times, offsets)
+			size = os.path.getsize(entries[0])
+			trace_cache.max_size = 2 * size
+			trace_cache.store_index(origins[1], times, offsets)
+			# the first entry is older, but was used last
+			now = os.stat(entries[1]).st_mtime
+			os.utime(entries[0], (now - 20, now - 20))
+			os.utime(entries[1], (now - 10, now - 10))
+			self.assertTrue(trace_cache.load_index(origins[0]) is not None)
+			trace_cache.store_index(origins[2], times, offsets)
+			self.assertEqual([True, False, True], [os.path.exists(entry) for entry in entries])
+		finally:
+			shutil.rmtree(cache_dir)
+
+	def testLibraryOptions(self):
+		# options with only the attributes a Trace used to read
+		class Options:
+			boottime = False
+			crop_after = None
+			show_all = False
+			annotate = None
+			prune = True
+		cache_home = tempfile.mkdtemp()
+		saved = os.environ.get('XDG_CACHE_HOME')
+		os.environ['XDG_CACHE_HOME'] = cache_home
+		try:
+			trace = parsing.Trace(writer, args, Options())
+			self.assertEqual(parsing.Trace(writer, args, options).proc_tree.num_proc, trace.proc_tree.num_proc)
+			# the cache is off without a directory for it
+			self.assertEqual([], os.listdir(cache_home))
+		finally:
+			if saved is None:
+				del os.environ['XDG_CACHE_HOME']
+			else:
+				os.environ['XDG_CACHE_HOME'] = saved
+			shutil.rmtree(cache_home)
+
+	def testPruneViews(self):
+		trace = parsing.Trace(writer, args, options)
+		unpruned_options, unpruned_args = parser.parse_args(['--q', '--no-cache', '-n', bootchart_dir])
+		unpruned = parsing.Trace(writer, unpruned_args, unpruned_options)
+		samples = dict((key, len(proc.samples)) for key, proc in trace.ps_stats.process_map.items())
+		pruned_tree = trace.proc_tree.process_tree
+		pruned_num_proc = trace.proc_tree.num_proc
+		pruned_order = list(trace.proc_tree.layout()[0])
+		trace.proc_tree.set_view(False)
+		self.assertEqual(unpruned.proc_tree.num_proc, trace.proc_tree.num_proc)
+		self.assertTrue(trace.proc_tree.num_proc > pruned_num_proc)
+		trace.proc_tree.set_view(True)
+		self.assertTrue(pruned_tree is trace.proc_tree.process_tree)
+		self.assertEqual(pruned_num_proc, trace.proc_tree.num_proc)
+		self.assertEqual(pruned_order, trace.proc_tree.layout()[0])
+		# the processes parsed are left as they were
+		self.assertEqual(samples, dict((key, len(proc.samples)) for key, proc in trace.ps_stats.process_map.items()))
+
+	def testSampleTotals(self):
+		trace = parsing.Trace(writer, args, options)
+		for proc in trace.ps_stats.process_map.values():
+			samples = proc.samples
+			self.assertEqual(sum(1 for s in samples if s.cpu_sample.user + s.cpu_sample.sys + s.cpu_sample.io > 0.0),
+					 samples.active_count)
+			self.assertEqual(sum(1 for s in samples if s.state == 'D'), samples.wait_count)
+			self.assertTrue(floatEq(sum(s.cpu_sample.cpu for s in samples), samples.cpu_total))
+
+	def testAnnotate(self):
+		annotate_options, annotate_args = parser.parse_args(['--q', '--no-cache', '--annotate=udevd', '--annotate=nosuchproc',
+								     '--annotate=nosuchproc,hald', bootchart_dir])
+		trace = parsing.Trace(writer, annotate_args, annotate_options)
+		starts = lambda cmd: [proc.start_time for proc in trace.ps_stats.process_map.values() if proc.cmd == cmd]
+		self.assertEqual([None, min(starts('udevd')), None, min(starts('hald'))], trace.times)
+
+	def testIdleSeries(self):
+		series = parsing._IdleSeries([0, 100, 200, 300, 400, 500], [0.9, 0.1, 0.6, 0.1, 0.1, 0.1])
+		self.assertFalse(series.is_idle(0, 200, 0.25))
+		self.assertFalse(series.is_idle(100, 200, 0.25))
+		self.assertTrue(series.is_idle(100, 200, 0.5))
+		self.assertTrue(series.is_idle(250, 200, 0.25))
+		self.assertFalse(series.is_idle(600, 200, 0.25))
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -7,6 +7,7 @@ sys.path.insert(0, os.getcwd())
 import pybootchartgui.parsing as parsing
 import pybootchartgui.process_tree as process_tree
 import pybootchartgui.main as main
+import pybootchartgui.samples as samples
 
 if sys.version_info >= (3, 0):
     long = int
@@ -18,7 +19,7 @@ class TestProcessTree(unittest.TestCase):
         self.rootdir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
 
         parser = main._mk_options_parser()
-        options, args = parser.parse_args(['--q', self.rootdir])
+        options, args = parser.parse_args(['--q', '--no-cache', self.rootdir])
         writer = main._mk_writer(options)
         self.writer = writer
         trace = parsing.Trace(writer, args, options)
@@ -101,5 +102,81 @@ class TestProcessTree(unittest.TestCase):
         process_tree = self.processtree.process_tree
         self.checkAgainstJavaExtract(self.mk_fname('extract.processtree.3e.log'), process_tree)
 
+    def testLayout(self):
+        order, depths, sizes = self.processtree.layout()
+        self.assertEqual(self.flatten(self.processtree.process_tree), order)
+        for row, proc in enumerate(order):
+            self.assertEqual(row, self.processtree.row_of(proc))
+            self.assertEqual(self.processtree.num_nodes([proc]), sizes[row])
+        self.processtree.prune(self.processtree.process_tree, None)
+        order, depths, sizes = self.processtree.layout()
+        self.assertEqual(self.flatten(self.processtree.process_tree), order)
+        self.assertEqual(self.processtree.num_nodes(self.processtree.process_tree), len(order))
+        for root in self.processtree.process_tree:
+            self.assertEqual(0, depths[self.processtree.row_of(root)])
+
+    def testLinesPast(self):
+        for prune in (False, True):
+            if prune:
+                self.processtree.prune(self.processtree.process_tree, None)
+            order = self.processtree.layout()[0]
+            parents = [self.processtree.parent_row(row) for row in range(len(order))]
+            for row in range(len(order)):
+                # the children below row of the parents in or above it
+                expected = [(parents[child], child) for child in range(row + 1, len(order))
+                            if 0 <= parents[child] <= row]
+                self.assertEqual(sorted(expected), sorted(self.processtree.lines_past(row)))
+
+    def testLinesPastDeepChild(self):
+        # a parent whose first child heads a long chain, with the second
+        # child far below it
+        procs = [samples.Process(self.writer, 1000, 'init', 0, 0)]
+        for idx in range(10):
+            proc = samples.Process(self.writer, (idx + 2) * 1000, 'sh', 0, idx + 1)
+            proc.parent = procs[-1]
+            procs.append(proc)
+        last = samples.Process(self.writer, 12000, 'sh', 0, 20)
+        last.parent = procs[0]
+        procs.append(last)
+        for proc in procs:
+            proc.duration = 10
+        stats = samples.ProcessStats(self.writer, dict((p.pid, p) for p in procs), 2, 1, 0, 30)
+        tree = process_tree.ProcessTree(self.writer, None, stats, 1, None, False, None, None, True, for_testing = True)
+        self.assertEqual(procs, tree.layout()[0])
+        self.assertEqual([(5, 6), (0, 11)], tree.lines_past(5))
+        self.assertEqual([(1, 2), (0, 11)], tree.lines_past(1))
+        self.assertEqual([(0, 11)], tree.lines_past(10))
+        self.assertEqual([], tree.lines_past(11))
+
+    def testDeepTree(self):
+        depth = 5 * sys.getrecursionlimit()
+        chain = []
+        for idx in range(depth):
+            proc = samples.Process(self.writer, (idx + 1) * 1000, 'sh', 0, idx)
+            proc.duration = 10
+            if chain:
+                proc.parent = chain[-1]
+            chain.append(proc)
+        stats = samples.ProcessStats(self.writer, dict((p.pid, p) for p in chain), 2, 1, 0, depth)
+        tree = process_tree.ProcessTree(self.writer, None, stats, 1, None, False, None, None, True)
+        self.assertEqual(depth, tree.num_proc)
+        self.assertEqual((0, depth + 9, depth * 1000), tree.get_extents(tree.process_tree))
+        self.assertEqual(depth - 1, tree.layout()[1][-1])
+
+    def testIntervals(self):
+        tree = self.processtree
+        procs = self.flatten(tree.process_tree)
+        end = lambda p: p.start_time + p.duration
+        for start, stop in [(0, 0), (150, 150), (150, 400), (1000, 1200), (end(procs[-1]), end(procs[-1]) + 100)]:
+            expected = set(p for p in procs if p.start_time <= stop and end(p) >= start)
+            self.assertEqual(expected, set(tree.overlaps(start, stop)))
+            self.assertEqual(set(p for p in procs if p.start_time <= start <= end(p)), set(tree.active_at(start)))
+        proc = max(procs, key = lambda p: len(p.samples))
+        for idx, sample in enumerate(proc.samples):
+            if idx + 1 == len(proc.samples) or proc.samples.time[idx + 1] > sample.time:
+                self.assertEqual(sample.state, tree.state_at(proc.pid, sample.time))
+        self.assertEqual(None, tree.state_at(proc.pid, proc.samples.time[0] - 1))
+        self.assertEqual(None, tree.state_at(-1, proc.samples.time[0]))
+
 if __name__ == '__main__':
     unittest.main()